@@ -1,16 +1,47 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import hashlib
+import hmac
 import os
-from dotenv import load_dotenv
+import threading
+import time
 
-load_dotenv()
+from cache import TTLCache
+import config  # noqa: F401  (loads .env before the settings below are read)
+import models
 
 SECRET_KEY = os.getenv("SECRET_KEY", "change-this-secret-key-in-production-please")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Verified tokens are cached per process. Deleting an account evicts its tokens here and,
+# on Postgres, in every other API process (events.py). Without that relay a deleted user
+# stays resolvable on other workers for at most TOKEN_CACHE_TTL seconds, for reads only:
+# get_current_user re-checks the user row before every write.
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# bcrypt cost factor. Hashes made with any other cost are transparently re-hashed on the
+# user's next successful login (see verify_and_update_password).
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Password hashing runs on its own threads (bcrypt releases the GIL) so a burst of logins
+# cannot starve the threadpool that serves everything else. Beyond HASH_WORKERS running
+# jobs, at most HASH_QUEUE_LIMIT more may wait; further requests are rejected with 503.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 
 def hash_password(password: str) -> str:
@@ -21,14 +52,128 @@ def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
 
-def create_token(email: str) -> str:
+def verify_and_update_password(plain: str, hashed: str):
+    """Return (valid, new_hash); new_hash is set when `hashed` uses an outdated cost."""
+    return pwd_context.verify_and_update(plain, hashed)
+
+
+class HashPoolFull(Exception):
+    """Raised instead of queueing when the password hashing pool is saturated."""
+
+
+class HashPool:
+    """Bounded executor for bcrypt work with a hard cap on queued jobs."""
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.capacity = workers + queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+
+    def _call(self, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.capacity:
+                self.rejected += 1
+                raise HashPoolFull()
+            self.pending += 1
+        try:
+            return self._executor.submit(self._call, fn, *args)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+hash_pool = HashPool(HASH_WORKERS, HASH_QUEUE_LIMIT)
+
+
+async def hash_password_async(password: str) -> str:
+    return await hash_pool.run(hash_password, password)
+
+
+async def verify_and_update_password_async(plain: str, hashed: str):
+    return await hash_pool.run(verify_and_update_password, plain, hashed)
+
+
+def create_token(email: str, user_id: int) -> str:
     expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
-    return jwt.encode({"sub": email, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode({"sub": email, "uid": user_id, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_token(token: str):
+def verify_token(token: str) -> Optional[dict]:
+    """Return the token's claims, or None if the signature or expiry check fails."""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload.get("sub")
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
+
+
+# ── Read-your-writes marker ───────────────────────────────────────────────────
+
+def _sign(payload: str) -> str:
+    return hmac.new(SECRET_KEY.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def read_primary_token(user_id: int, seconds: float) -> str:
+    """Signed "read `user_id` from the primary for `seconds`" value for
+    database.READ_PRIMARY_HEADER; any worker can check it with reads_primary."""
+    payload = f"{user_id}.{time.time() + seconds:.3f}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def reads_primary(value: Optional[str], user_id: int) -> bool:
+    """True while `value` is an unexpired read_primary_token for `user_id`."""
+    if not value:
+        return False
+    payload, _, signature = value.rpartition(".")
+    uid, _, until = payload.partition(".")
+    if not hmac.compare_digest(signature, _sign(payload)) or uid != str(user_id):
+        return False
+    try:
+        return float(until) > time.time()
+    except ValueError:
+        return False
+
+
+# ── Token → user cache ────────────────────────────────────────────────────────
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Detached snapshot of the columns request handlers need from a User row."""
+
+    id: int
+    email: str
+    name: str
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, user: models.User) -> "CachedUser":
+        return cls(id=user.id, email=user.email, name=user.name, created_at=user.created_at)
+
+
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+
+def cache_user(token: str, claims: dict, user: models.User) -> CachedUser:
+    cached = CachedUser.from_model(user)
+    token_cache.set(token, cached, ttl=claims["exp"] - time.time())
+    return cached
+
+
+def invalidate_user(user_id: int) -> int:
+    """Forget every cached token belonging to `user_id`."""
+    return token_cache.discard_if(lambda user: user.id == user_id)
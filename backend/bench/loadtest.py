@@ -0,0 +1,202 @@
+"""Closed-loop HTTP load test against a running API seeded by bench.seed.
+
+    python -m bench.loadtest --url http://localhost:8000 --concurrency 32 --duration 60
+    python -m bench.loadtest ... --save bench/baselines/loadtest.json
+    python -m bench.loadtest ... --baseline bench/baselines/loadtest.json [--tolerance 0.15]
+
+`--concurrency` workers each log in as a different bench user. Then, until `--duration`
+runs out, they send the request mix in SCENARIOS back to back. The report gives
+throughput and p50/p95/p99 latency per scenario. With `--baseline`, the exit status is 1
+when any scenario's p95 or throughput is more than `--tolerance` worse than the baseline.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+
+from bench.seed import BENCH_PASSWORD, EMAIL_PATTERN
+
+# name: (weight, read-only)
+SCENARIOS = {
+    "list_expenses": (35, True),
+    "list_expenses_next_page": (10, True),
+    "list_expenses_revalidate": (10, True),
+    "analytics_summary": (15, True),
+    "analytics_trend": (10, True),
+    "budget": (10, True),
+    "me": (5, True),
+    "create_expense": (5, False),
+}
+
+
+class Worker:
+    def __init__(self, client: httpx.AsyncClient, token: str, rng: random.Random):
+        self.client = client
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.rng = rng
+        self.cursor = None
+        self.etag = None
+
+    async def list_expenses(self):
+        resp = await self.client.get("/expenses", headers=self.headers)
+        self.cursor = resp.headers.get("x-next-cursor")
+        self.etag = resp.headers.get("etag")
+        return resp
+
+    async def list_expenses_next_page(self):
+        if not self.cursor:
+            return await self.list_expenses()
+        return await self.client.get("/expenses", params={"cursor": self.cursor}, headers=self.headers)
+
+    async def list_expenses_revalidate(self):
+        if not self.etag:
+            return await self.list_expenses()
+        return await self.client.get("/expenses", headers={**self.headers, "If-None-Match": self.etag})
+
+    async def analytics_summary(self):
+        return await self.client.get("/analytics/summary", headers=self.headers)
+
+    async def analytics_trend(self):
+        return await self.client.get("/analytics/trend", params={"months": 12}, headers=self.headers)
+
+    async def budget(self):
+        return await self.client.get("/budget", headers=self.headers)
+
+    async def me(self):
+        return await self.client.get("/auth/me", headers=self.headers)
+
+    async def create_expense(self):
+        return await self.client.post("/expenses", headers=self.headers, json={
+            "amount": round(self.rng.uniform(1, 80), 2),
+            "category": self.rng.choice(["Food & Drink", "Transport", "Shopping"]),
+            "note": "loadtest",
+            "date": datetime.now().isoformat(timespec="seconds"),
+        })
+
+
+def percentile(ordered: list, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+    }
+
+
+async def login(client: httpx.AsyncClient, user: int) -> str:
+    resp = await client.post("/auth/login", json={"email": EMAIL_PATTERN.format(user), "password": BENCH_PASSWORD})
+    resp.raise_for_status()
+    return resp.json()["access_token"]
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    scenarios = {name: weight for name, (weight, read_only) in SCENARIOS.items() if read_only or args.writes}
+    names, weights = list(scenarios), list(scenarios.values())
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        users = rng.sample(range(1, args.users + 1), args.concurrency)
+        tokens = await asyncio.gather(*(login(client, u) for u in users))
+        workers = [Worker(client, t, random.Random(rng.random())) for t in tokens]
+
+        started = time.perf_counter()
+        deadline = started + args.duration
+
+        async def loop(worker: Worker):
+            while time.perf_counter() < deadline:
+                name = worker.rng.choices(names, weights=weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    resp = await getattr(worker, name)()
+                    failed = resp.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                latencies[name].append(time.perf_counter() - t0)
+                errors[name] += failed
+
+        await asyncio.gather(*(loop(w) for w in workers))
+        elapsed = time.perf_counter() - started
+
+    report = {name: summarize(latencies[name], errors[name], elapsed) for name in names}
+    report["total"] = summarize(
+        [v for values in latencies.values() for v in values], sum(errors.values()), elapsed,
+    )
+    return {
+        "config": {k: getattr(args, k) for k in ("concurrency", "duration", "users", "writes", "seed")},
+        "scenarios": report,
+    }
+
+
+def print_report(result: dict):
+    print(f"{'scenario':28} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, s in result["scenarios"].items():
+        print(
+            f"{name:28} {s['requests']:>9} {s['errors']:>7} {s['rps']:>8} "
+            f"{s['p50_ms']:>8} {s['p95_ms']:>8} {s['p99_ms']:>8}"
+        )
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Return one message per scenario that regressed beyond `tolerance`."""
+    regressions = []
+    for name, base in baseline["scenarios"].items():
+        now = result["scenarios"].get(name)
+        if now is None or not base["requests"]:
+            continue
+        if now["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {now['p95_ms']}ms")
+        if now["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['rps']} -> {now['rps']} req/s")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--users", type=int, default=10_000, help="bench users available to log in as")
+    parser.add_argument("--writes", action="store_true", help="include POST /expenses in the mix")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="write the results as JSON to this path")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.tolerance:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Seeded synthetic data for benchmarks and load tests.
+
+    python -m bench.seed --users 10000 --expenses 1000000 [--seed 42] [--end-date 2024-06-30]
+
+Run from backend/ against a migrated database (``alembic upgrade head``). Spending is skewed
+the way real accounts are: a few heavy users hold most of the rows, categories follow fixed
+weights with per-category log-normal amounts, and dates cover ``--months`` months with
+more activity at weekends. The same seed and end date always produce the same rows.
+
+Every user is ``bench-<n>@example.com`` with password ``BENCH_PASSWORD``. On Postgres rows
+are loaded with COPY; other databases fall back to batched INSERTs (fine for smoke runs).
+"""
+import argparse
+import csv
+import io
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, insert, select, text
+
+import auth
+import models
+import rollup
+from database import SessionLocal, engine
+
+BENCH_PASSWORD = "bench-password"
+EMAIL_PATTERN = "bench-{}@example.com"
+BATCH_SIZE = 50_000
+
+# category: (relative frequency, log-normal mu, sigma) — medians of roughly $12 for food,
+# $1,100 for housing.
+CATEGORIES = {
+    "Food & Drink": (30, 2.5, 0.7),
+    "Transport": (15, 2.7, 0.8),
+    "Shopping": (14, 3.5, 1.0),
+    "Entertainment": (10, 3.0, 0.8),
+    "Utilities": (9, 4.3, 0.5),
+    "Health": (6, 3.6, 0.9),
+    "Housing": (4, 7.0, 0.3),
+    "Other": (12, 3.0, 1.1),
+}
+NOTES = {
+    "Food & Drink": ["Groceries", "Coffee", "Lunch", "Dinner out", "Takeaway", ""],
+    "Transport": ["Fuel", "Train ticket", "Bus pass", "Taxi", "Parking", ""],
+    "Shopping": ["Clothes", "Electronics", "Books", "Online order", ""],
+    "Entertainment": ["Cinema", "Streaming", "Concert", "Games", ""],
+    "Utilities": ["Electricity", "Water", "Internet", "Phone", ""],
+    "Health": ["Pharmacy", "Dentist", "Gym", ""],
+    "Housing": ["Rent", "Repairs", ""],
+    "Other": ["Gift", "Fees", "Donation", ""],
+}
+# Monday..Sunday
+WEEKDAY_WEIGHTS = (0.9, 0.9, 0.95, 1.0, 1.2, 1.5, 1.3)
+
+
+def generate_expenses(rng: random.Random, user_ids: list, category_ids: dict, count: int, start: date, days: int):
+    """Yield lists of expense dicts, at most BATCH_SIZE at a time.
+
+    `category_ids` maps each name in CATEGORIES to its default category's id.
+    """
+    # Pareto activity weights: a few heavy users, a long tail of light ones.
+    activity = [min(rng.paretovariate(1.16), 500.0) for _ in user_ids]
+    categories = list(CATEGORIES)
+    category_weights = [CATEGORIES[c][0] for c in categories]
+    day_offsets = list(range(days))
+    day_weights = [WEEKDAY_WEIGHTS[(start + timedelta(d)).weekday()] for d in day_offsets]
+
+    remaining = count
+    while remaining:
+        n = min(BATCH_SIZE, remaining)
+        remaining -= n
+        owners = rng.choices(user_ids, weights=activity, k=n)
+        picked = rng.choices(categories, weights=category_weights, k=n)
+        offsets = rng.choices(day_offsets, weights=day_weights, k=n)
+        batch = []
+        for user_id, category, offset in zip(owners, picked, offsets):
+            _, mu, sigma = CATEGORIES[category]
+            when = datetime.combine(start + timedelta(offset), datetime.min.time()) + timedelta(
+                seconds=rng.randint(7 * 3600, 23 * 3600),
+            )
+            batch.append({
+                "user_id": user_id,
+                "amount": round(rng.lognormvariate(mu, sigma), 2),
+                "category_id": category_ids[category],
+                "note": rng.choice(NOTES[category]),
+                "date": when,
+                "created_at": when + timedelta(minutes=rng.randint(0, 600)),
+            })
+        yield batch
+
+
+def _copy(db, table: str, columns: tuple, rows: list):
+    buf = io.StringIO()
+    # QUOTE_NONNUMERIC: an empty note must load as "" rather than NULL.
+    csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC).writerows([r[c] for c in columns] for r in rows)
+    buf.seek(0)
+    cursor = db.connection().connection.cursor()
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def load(db, model, rows: list):
+    if db.get_bind().dialect.name == "postgresql":
+        _copy(db, model.__tablename__, tuple(rows[0]), rows)
+    else:
+        db.execute(insert(model), rows)
+
+
+def reset(db):
+    """Delete every bench-* user and everything they own."""
+    ids = select(models.User.id).where(models.User.email.like(EMAIL_PATTERN.format("%")))
+    for model in (models.MonthlyCategoryTotal, models.Budget, models.Expense, models.Category):
+        db.execute(delete(model).where(model.user_id.in_(ids)))
+    db.execute(delete(models.User).where(models.User.id.in_(ids)))
+
+
+def seed(db, users: int, expenses: int, seed: int, end: date, months: int, budget_share: float):
+    rng = random.Random(seed)
+    start = end - timedelta(days=round(months * 30.44))
+    # One hash for everyone: hashing 10k passwords at full cost would dominate the run.
+    hashed = auth.hash_password(BENCH_PASSWORD)
+    joined = datetime.combine(start, datetime.min.time())
+
+    load(db, models.User, [
+        {"email": EMAIL_PATTERN.format(i), "name": f"Bench User {i}", "hashed_password": hashed,
+         "created_at": joined, "data_version": 0}
+        for i in range(1, users + 1)
+    ])
+    user_ids = sorted(db.scalars(
+        select(models.User.id).where(models.User.email.like(EMAIL_PATTERN.format("%")))
+    ))
+
+    budgets = [
+        {"user_id": uid, "monthly_limit": float(rng.choice((500, 1000, 1500, 2000, 3000, 5000))),
+         "updated_at": joined}
+        for uid in user_ids if rng.random() < budget_share
+    ]
+    if budgets:
+        load(db, models.Budget, budgets)
+
+    category_ids = dict(db.execute(
+        select(models.Category.name, models.Category.id).where(models.Category.user_id.is_(None))
+    ).all())
+    loaded = 0
+    for batch in generate_expenses(rng, user_ids, category_ids, expenses, start, (end - start).days + 1):
+        load(db, models.Expense, batch)
+        loaded += len(batch)
+        print(f"  {loaded:,}/{expenses:,} expenses", end="\r", flush=True)
+    print()
+    return user_ids
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--expenses", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date.today(),
+                        help="last day of generated history (default: today)")
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--budget-share", type=float, default=0.6,
+                        help="fraction of users with a custom budget")
+    parser.add_argument("--reset", action="store_true", help="delete existing bench-* users first")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        existing = db.scalar(
+            select(models.User.id).where(models.User.email.like(EMAIL_PATTERN.format("%"))).limit(1)
+        )
+        if existing is not None:
+            if not args.reset:
+                print("bench users already exist; pass --reset to replace them", file=sys.stderr)
+                return 1
+            reset(db)
+        seed(db, args.users, args.expenses, args.seed, args.end_date, args.months, args.budget_share)
+        buckets = rollup.rebuild(db)
+        db.commit()
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM ANALYZE"))
+    print(
+        f"seeded {args.users:,} users, {args.expenses:,} expenses, {buckets:,} rollup buckets "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
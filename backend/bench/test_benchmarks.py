@@ -0,0 +1,99 @@
+"""Micro-benchmarks of the hot endpoints through TestClient, against a database seeded by bench.seed.
+
+    pytest bench/ --benchmark-storage=bench/baselines --benchmark-autosave
+    pytest bench/ --benchmark-storage=bench/baselines --benchmark-compare --benchmark-compare-fail=median:15%
+
+Each benchmark runs as the heaviest seeded user, which is the worst case for the list and
+analytics queries. Not collected by the regular test run (pytest.ini only looks in tests/).
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+import models  # noqa: E402
+from bench.seed import BENCH_PASSWORD, EMAIL_PATTERN  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from main import app  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture(scope="module")
+def heavy_user():
+    with SessionLocal() as db:
+        row = db.execute(
+            select(models.User.email, func.max(models.Expense.date))
+            .join(models.Expense, models.Expense.user_id == models.User.id)
+            .where(models.User.email.like(EMAIL_PATTERN.format("%")))
+            .group_by(models.User.id, models.User.email)
+            .order_by(func.count(models.Expense.id).desc())
+            .limit(1)
+        ).first()
+    if row is None:
+        pytest.skip("no bench data; run `python -m bench.seed` first")
+    return {"email": row[0], "latest": row[1]}
+
+
+@pytest.fixture(scope="module")
+def headers(client, heavy_user):
+    resp = client.post("/auth/login", json={"email": heavy_user["email"], "password": BENCH_PASSWORD})
+    assert resp.status_code == 200
+    return {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+
+def run(benchmark, client, url, headers, expected=200):
+    resp = benchmark(client.get, url, headers=headers)
+    assert resp.status_code == expected
+    return resp
+
+
+def test_list_expenses_first_page(benchmark, client, headers):
+    run(benchmark, client, "/expenses", headers)
+
+
+def test_list_expenses_deep_page(benchmark, client, headers):
+    url = "/expenses?limit=100"
+    for _ in range(20):
+        url = f"/expenses?limit=100&cursor={client.get(url, headers=headers).headers['x-next-cursor']}"
+    run(benchmark, client, url, headers)
+
+
+def test_list_expenses_by_category(benchmark, client, headers):
+    run(benchmark, client, "/expenses?category=Housing", headers)
+
+
+def test_list_expenses_not_modified(benchmark, client, headers):
+    etag = client.get("/expenses", headers=headers).headers["etag"]
+    run(benchmark, client, "/expenses", {**headers, "If-None-Match": etag}, expected=304)
+
+
+def test_analytics_summary(benchmark, client, headers, heavy_user):
+    latest = heavy_user["latest"]
+    run(benchmark, client, f"/analytics/summary?month={latest.month}&year={latest.year}", headers)
+
+
+def test_analytics_trend_year(benchmark, client, headers, heavy_user):
+    latest = heavy_user["latest"]
+    run(benchmark, client, f"/analytics/trend?months=12&month={latest.month}&year={latest.year}", headers)
+
+
+def test_budget(benchmark, client, headers):
+    run(benchmark, client, "/budget", headers)
+
+
+def test_auth_me_cached_token(benchmark, client, headers):
+    run(benchmark, client, "/auth/me", headers)
+
+
+def test_login(benchmark, client, heavy_user):
+    # bcrypt-bound by design; a few rounds are enough to spot a cost-factor change.
+    payload = {"email": heavy_user["email"], "password": BENCH_PASSWORD}
+    resp = benchmark.pedantic(client.post, args=("/auth/login",), kwargs={"json": payload}, rounds=10)
+    assert resp.status_code == 200
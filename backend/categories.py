@@ -0,0 +1,148 @@
+"""Expense categories and the in-process id <-> name cache.
+
+Expenses and the rollup store a ``category_id``; the API still speaks category names.
+There are two kinds of category:
+
+* the system defaults in DEFAULTS (``user_id`` NULL), shared by everyone;
+* custom categories owned by one user. Writing an expense with a name that is not yet
+  visible to the user creates one, so clients can send any name as before.
+
+Rows are never renamed and ids are never reused while the process runs, so ``cache`` keeps
+every mapping it has seen for the life of the process. A miss costs one indexed query.
+Categories created inside a transaction are cached only once that transaction commits.
+"""
+import threading
+from typing import Iterable, Optional
+
+from sqlalchemy import event, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+
+# Seeded by migration 0006, in this order.
+DEFAULTS = (
+    "Food & Drink", "Transport", "Housing", "Entertainment",
+    "Health", "Shopping", "Utilities", "Other",
+)
+
+_DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+# Session.info key for (id, user_id, name) rows created in the session's open transaction.
+_PENDING = "categories_created"
+
+Category = models.Category
+
+
+class CategoryCache:
+    def __init__(self):
+        self._names = {}  # id -> name
+        self._ids = {}    # (user_id, name) -> id; user_id is None for the defaults
+        self._lock = threading.Lock()
+
+    def _store(self, rows: Iterable[tuple]):
+        with self._lock:
+            for category_id, user_id, name in rows:
+                self._names[category_id] = name
+                self._ids[(user_id, name)] = category_id
+
+    def _committed(self, db: Session, rows) -> list:
+        pending = {row[0] for row in db.info.get(_PENDING, ())}
+        return [row for row in rows if row[0] not in pending]
+
+    def names(self, db: Session, ids: Iterable[int]) -> dict:
+        """Map each of `ids` to its name, loading any misses in one query."""
+        ids = set(ids)
+        missing = ids - self._names.keys()
+        if missing:
+            rows = db.execute(
+                select(Category.id, Category.user_id, Category.name).where(Category.id.in_(missing))
+            ).all()
+            self._store(self._committed(db, rows))
+            found = {row[0]: row[2] for row in rows}
+        else:
+            found = {}
+        return {i: self._names[i] if i in self._names else found[i] for i in ids}
+
+    def name(self, db: Session, category_id: int) -> str:
+        return self.names(db, (category_id,))[category_id]
+
+    def lookup(self, db: Session, user_id: int, name: str) -> Optional[int]:
+        """Id of the category called `name` that `user_id` can see, or None.
+
+        A default wins over a custom category of the same name.
+        """
+        for key in ((None, name), (user_id, name)):
+            if key in self._ids:
+                return self._ids[key]
+        rows = db.execute(
+            select(Category.id, Category.user_id, Category.name).where(
+                Category.name == name, or_(Category.user_id.is_(None), Category.user_id == user_id),
+            )
+        ).all()
+        self._store(self._committed(db, rows))
+        return min(rows, key=lambda row: row[1] is not None)[0] if rows else None
+
+    def resolve(self, db: Session, user_id: int, name: str) -> int:
+        """Id of `name` for `user_id`, creating a custom category if needed. Does not commit."""
+        if not name.strip():
+            raise ValueError("Category name must not be blank")
+        category_id = self.lookup(db, user_id, name)
+        if category_id is not None:
+            return category_id
+        insert = _DIALECT_INSERTS[db.get_bind().dialect.name]
+        # Concurrent writers may create the same category; the loser reads the winner's row.
+        db.execute(
+            insert(Category).values(user_id=user_id, name=name)
+            .on_conflict_do_nothing(index_elements=[Category.user_id, Category.name])
+        )
+        category_id = db.scalar(select(Category.id).where(Category.user_id == user_id, Category.name == name))
+        db.info.setdefault(_PENDING, []).append((category_id, user_id, name))
+        return category_id
+
+    def resolve_many(self, db: Session, user_id: int, names: Iterable[str]) -> dict:
+        return {name: self.resolve(db, user_id, name) for name in set(names)}
+
+    def forget_user(self, user_id: int):
+        """Drop a deleted user's custom categories."""
+        with self._lock:
+            for key in [k for k in self._ids if k[0] == user_id]:
+                self._names.pop(self._ids.pop(key), None)
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+            self._ids.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._names)}
+
+
+cache = CategoryCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_created(session):
+    created = session.info.pop(_PENDING, None)
+    if created:
+        cache._store(created)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_created(session, previous_transaction):
+    session.info.pop(_PENDING, None)
+
+
+def for_user(db: Session, user_id: int) -> list:
+    """Categories visible to `user_id`: the defaults in DEFAULTS order, then custom ones by name."""
+    rows = db.execute(
+        select(Category.id, Category.user_id, Category.name)
+        .where(or_(Category.user_id.is_(None), Category.user_id == user_id))
+        .order_by(Category.user_id.is_not(None), Category.id)
+    ).all()
+    cache._store(cache._committed(db, rows))
+    custom = sorted((row for row in rows if row[1] is not None), key=lambda row: row[2].lower())
+    return [
+        {"id": category_id, "name": name, "custom": owner is not None}
+        for category_id, owner, name in [row for row in rows if row[1] is None] + custom
+    ]
+
@@ -0,0 +1,14 @@
+"""Process-wide settings bootstrap.
+
+Imported first by every module that reads the environment, so ``backend/.env`` is loaded
+exactly once per process. Real environment variables always win over the file.
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
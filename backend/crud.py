@@ -0,0 +1,449 @@
+"""Database operations behind the API routes.
+
+Everything here is plain synchronous SQLAlchemy taking a ``Session``. Route handlers call
+these through ``database.run_db``, which runs them on the threadpool in sync mode or inside
+``AsyncSession.run_sync`` in async mode, so the query code is written once for both.
+Functions that write commit before returning.
+"""
+import base64
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+
+from sqlalchemy import delete, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+import categories
+import database
+import events
+import models
+import rollup
+import schemas
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+DEFAULT_MONTHLY_LIMIT = 2000.0
+
+EXPENSE_COLUMNS = tuple(models.Expense.__table__.c)
+# The columns behind schemas.ExpenseOut, in its field order, with category_id for category.
+EXPENSE_OUT_COLUMNS = tuple(
+    models.Expense.__table__.c["category_id" if name == "category" else name]
+    for name in schemas.ExpenseOut.model_fields
+)
+# Matches no expense: the filter for a category name the user does not have.
+NO_CATEGORY = 0
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+
+def encode_cursor(expense: models.Expense) -> str:
+    raw = f"{expense.date.isoformat()}|{expense.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Inverse of `encode_cursor`; raises ValueError for anything it did not produce."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    date_part, id_part = base64.urlsafe_b64decode(padded).decode().split("|")
+    return datetime.fromisoformat(date_part), int(id_part)
+
+
+def month_range(year: int, month: int):
+    start = datetime(year, month, 1)
+    end = datetime(year, month + 1, 1) if month < 12 else datetime(year + 1, 1, 1)
+    return start, end
+
+
+def shift_month(year: int, month: int, delta: int):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def commit(db: Session):
+    db.commit()
+
+
+def close(db: Session):
+    db.close()
+
+
+# ── Users ─────────────────────────────────────────────────────────────────────
+
+def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.email == email).first()
+
+
+def get_user_for_claims(db: Session, claims: dict) -> Optional[models.User]:
+    if "uid" in claims:
+        return db.get(models.User, claims["uid"])
+    # Tokens issued before the uid claim was added only carry the email.
+    return get_user_by_email(db, claims.get("sub"))
+
+
+def create_user(db: Session, email: str, name: str, hashed_password: str) -> models.User:
+    user = models.User(email=email, name=name, hashed_password=hashed_password)
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    database.record_write(user.id)
+    return user
+
+
+def user_exists(db: Session, user_id: int) -> bool:
+    return db.query(models.User.id).filter(models.User.id == user_id).first() is not None
+
+
+def get_data_version(db: Session, user_id: int) -> int:
+    return db.query(models.User.data_version).filter(models.User.id == user_id).scalar() or 0
+
+
+def bump_data_version(db: Session, user_id: int):
+    """Invalidate the user's ETags. Call inside the write's transaction, before commit.
+
+    Also keeps the user's reads on the primary for a while (database.replica_sessionmaker)
+    and, once committed, wakes the user's budget streams (events.py).
+    """
+    database.record_write(user_id)
+    events.changed(db, user_id)
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {"data_version": models.User.data_version + 1}, synchronize_session=False,
+    )
+
+
+def set_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {"hashed_password": hashed_password}, synchronize_session=False,
+    )
+    db.commit()
+
+
+# ── Expenses ──────────────────────────────────────────────────────────────────
+
+def filter_expenses(
+    q,
+    category_id: Optional[int] = None,
+    search: Optional[str] = None,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    """Apply the shared /expenses filters. `date_from` is inclusive, `date_to` exclusive."""
+    if category_id is not None:
+        q = q.filter(models.Expense.category_id == category_id)
+    if search:
+        q = q.filter(models.Expense.note.ilike(f"%{search}%"))
+    if month and year:
+        start, end = month_range(year, month)
+        q = q.filter(models.Expense.date >= start, models.Expense.date < end)
+    if date_from:
+        q = q.filter(models.Expense.date >= date_from)
+    if date_to:
+        q = q.filter(models.Expense.date < date_to)
+    return q
+
+
+def expense_page_query(
+    db: Session,
+    user_id: int,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[tuple] = None,
+    **filters,
+):
+    """Newest-first page of a user's expenses, keyset-paginated on (date, id).
+
+    `after` is the decoded cursor of the previous page's last row. Fetches one row past
+    `limit` so the caller can tell whether another page exists without a COUNT query.
+    Selects plain column rows rather than ORM instances: pages are read-only, and skipping
+    identity-map bookkeeping is most of the per-row cost.
+    """
+    q = db.query(*EXPENSE_OUT_COLUMNS).filter(models.Expense.user_id == user_id)
+    q = filter_expenses(q, **filters)
+    if after:
+        # The redundant bound on date alone lets Postgres prune partitions newer than the
+        # cursor; it cannot see through the row comparison.
+        q = q.filter(models.Expense.date <= after[0], tuple_(models.Expense.date, models.Expense.id) < after)
+    return q.order_by(models.Expense.date.desc(), models.Expense.id.desc()).limit(limit + 1)
+
+
+def category_filter(db: Session, user_id: int, name: Optional[str]) -> Optional[int]:
+    """The `category_id` filter for a category name; NO_CATEGORY if the user has none by that name."""
+    if not name:
+        return None
+    category_id = categories.cache.lookup(db, user_id, name)
+    return NO_CATEGORY if category_id is None else category_id
+
+
+def expense_records(db: Session, rows) -> list:
+    """ExpenseOut-shaped dicts (same key order) for rows of EXPENSE_OUT_COLUMNS or ORM expenses."""
+    names = categories.cache.names(db, {row.category_id for row in rows})
+    return [
+        {
+            "amount": row.amount, "category": names[row.category_id], "note": row.note,
+            "date": row.date, "id": row.id, "user_id": row.user_id, "created_at": row.created_at,
+        }
+        for row in rows
+    ]
+
+
+def expense_out(db: Session, expense) -> dict:
+    return expense_records(db, [expense])[0]
+
+
+def list_expenses_page(
+    db: Session, user_id: int, limit: int, after: Optional[tuple], category: Optional[str] = None, **filters,
+):
+    """Return (records, next_cursor); next_cursor is None on the last page.
+
+    Records are dicts from ``expense_records``, ready for ``schemas.dump_expenses``.
+    """
+    category_id = category_filter(db, user_id, category)
+    if category_id == NO_CATEGORY:
+        return [], None
+    rows = expense_page_query(db, user_id, limit=limit, after=after, category_id=category_id, **filters).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return expense_records(db, rows), next_cursor
+
+
+def get_expense(db: Session, user_id: int, expense_id: int) -> Optional[models.Expense]:
+    return db.query(models.Expense).filter(
+        models.Expense.id == expense_id,
+        models.Expense.user_id == user_id
+    ).first()
+
+
+def _with_category_id(db: Session, user_id: int, data: dict) -> dict:
+    """Swap a `category` name in expense data for its (possibly new) category_id."""
+    if "category" not in data:
+        return data
+    data = dict(data)
+    data["category_id"] = categories.cache.resolve(db, user_id, data.pop("category"))
+    return data
+
+
+def create_expense(db: Session, user_id: int, data: dict) -> dict:
+    expense = models.Expense(**_with_category_id(db, user_id, data), user_id=user_id)
+    db.add(expense)
+    rollup.add(db, expense)
+    bump_data_version(db, user_id)
+    db.commit()
+    db.refresh(expense)
+    return expense_out(db, expense)
+
+
+def update_expense(db: Session, user_id: int, expense_id: int, data: dict) -> Optional[dict]:
+    expense = get_expense(db, user_id, expense_id)
+    if not expense:
+        return None
+    old = {"date": expense.date, "category_id": expense.category_id, "amount": expense.amount}
+    for k, v in _with_category_id(db, user_id, data).items():
+        setattr(expense, k, v)
+    rollup.move(db, old, expense)
+    bump_data_version(db, user_id)
+    db.commit()
+    db.refresh(expense)
+    return expense_out(db, expense)
+
+
+def delete_expense(db: Session, user_id: int, expense_id: int) -> bool:
+    expense = get_expense(db, user_id, expense_id)
+    if not expense:
+        return False
+    rollup.remove(db, expense)
+    db.delete(expense)
+    bump_data_version(db, user_id)
+    db.commit()
+    return True
+
+
+
+def apply_batch(db: Session, user_id: int, operations: list) -> list:
+    """Apply create/update/delete operations in one transaction; one result dict per operation.
+
+    Ownership of every referenced id is checked with a single
+    ``WHERE id IN (...) AND user_id = ...`` query. Operations are replayed in order against
+    those rows in memory, then written with one bulk DELETE, one bulk UPDATE and one
+    INSERT ... RETURNING. Operations on unknown ids get a 404 result without failing the batch.
+    """
+    ids = {op.id for op in operations if op.op != "create"}
+    current = {}
+    if ids:
+        rows = db.execute(
+            select(*EXPENSE_COLUMNS).where(models.Expense.id.in_(ids), models.Expense.user_id == user_id)
+        )
+        current = {row.id: dict(row._mapping) for row in rows}
+    original = {expense_id: dict(row) for expense_id, row in current.items()}
+
+    results = [None] * len(operations)
+    creates = []
+    for index, op in enumerate(operations):
+        result = {"index": index, "op": op.op}
+        if op.op == "create":
+            creates.append((index, _with_category_id(db, user_id, op.data.model_dump())))
+            continue
+        result["id"] = op.id
+        row = current.get(op.id)
+        if row is None:
+            results[index] = {**result, "status": 404, "error": "Expense not found"}
+        elif op.op == "update":
+            row.update(_with_category_id(db, user_id, op.data.model_dump(exclude_unset=True, exclude_none=True)))
+            results[index] = {**result, "status": 200, "expense": expense_out(db, SimpleNamespace(**row))}
+        else:
+            del current[op.id]
+            results[index] = {**result, "status": 204}
+
+    deltas = rollup.Deltas()
+    deleted = original.keys() - current.keys()
+    changed = [row for expense_id, row in current.items() if row != original[expense_id]]
+    for expense_id in deleted:
+        old = original[expense_id]
+        deltas.remove(old["date"], old["category_id"], old["amount"])
+    for row in changed:
+        old = original[row["id"]]
+        deltas.remove(old["date"], old["category_id"], old["amount"])
+        deltas.add(row["date"], row["category_id"], row["amount"])
+
+    if deleted:
+        db.execute(
+            delete(models.Expense).where(models.Expense.id.in_(deleted), models.Expense.user_id == user_id)
+        )
+    if changed:
+        db.execute(update(models.Expense), [
+            {k: row[k] for k in ("id", "amount", "category_id", "note", "date")} for row in changed
+        ])
+    if creates:
+        created = db.scalars(
+            insert(models.Expense).returning(models.Expense, sort_by_parameter_order=True),
+            [{**data, "user_id": user_id} for _, data in creates],
+        ).all()
+        for (index, _), expense in zip(creates, created):
+            deltas.add(expense.date, expense.category_id, expense.amount)
+            results[index] = {
+                "index": index, "op": "create", "status": 201, "id": expense.id,
+                "expense": expense_out(db, expense),
+            }
+
+    deltas.flush(db, user_id)
+    if deleted or changed or creates:
+        bump_data_version(db, user_id)
+    db.commit()
+    return results
+
+
+# ── Categories ────────────────────────────────────────────────────────────────
+
+def create_category(db: Session, user_id: int, name: str) -> dict:
+    """Create a custom category, or return the visible one already called `name`."""
+    existing = categories.cache.lookup(db, user_id, name)
+    if existing is None:
+        existing = categories.cache.resolve(db, user_id, name)
+        bump_data_version(db, user_id)
+        db.commit()
+    return {"id": existing, "name": name, "custom": name not in categories.DEFAULTS}
+
+
+# ── Budget ────────────────────────────────────────────────────────────────────
+
+def get_budget(db: Session, user_id: int) -> Optional[models.Budget]:
+    return db.query(models.Budget).filter(models.Budget.user_id == user_id).first()
+
+
+def get_or_create_budget(db: Session, user_id: int) -> models.Budget:
+    budget = get_budget(db, user_id)
+    if not budget:
+        budget = models.Budget(user_id=user_id, monthly_limit=DEFAULT_MONTHLY_LIMIT)
+        db.add(budget)
+        db.commit()
+        db.refresh(budget)
+    return budget
+
+
+def set_budget(db: Session, user_id: int, monthly_limit: float) -> models.Budget:
+    budget = get_budget(db, user_id)
+    if not budget:
+        budget = models.Budget(user_id=user_id, monthly_limit=monthly_limit)
+        db.add(budget)
+    else:
+        budget.monthly_limit = monthly_limit
+    bump_data_version(db, user_id)
+    db.commit()
+    db.refresh(budget)
+    return budget
+
+
+def get_monthly_limit(db: Session, user_id: int) -> float:
+    budget = get_budget(db, user_id)
+    return budget.monthly_limit if budget else DEFAULT_MONTHLY_LIMIT
+
+
+# ── Analytics ─────────────────────────────────────────────────────────────────
+
+def month_summary(db: Session, user_id: int, year: int, month: int,
+                  monthly_limit: Optional[float] = None) -> dict:
+    """`monthly_limit` saves looking the budget up when the caller already has it."""
+    rows = rollup.month_totals(db, user_id, year, month).all()
+    names = categories.cache.names(db, {category_id for category_id, _, _ in rows})
+    by_category = {}
+    expense_count = 0
+    for category_id, amount, count in rows:
+        by_category[names[category_id]] = amount
+        expense_count += count
+
+    return {
+        "total": sum(by_category.values()),
+        "monthly_limit": get_monthly_limit(db, user_id) if monthly_limit is None else monthly_limit,
+        "by_category": by_category,
+        "expense_count": expense_count,
+        "month": month,
+        "year": year,
+    }
+
+
+def budget_status(db: Session, user_id: int, year: int, month: int,
+                  monthly_limit: Optional[float] = None) -> dict:
+    """The month's summary plus how much of the limit it uses; what GET /stream/budget sends."""
+    status = month_summary(db, user_id, year, month, monthly_limit)
+    total, limit = status["total"], status["monthly_limit"]
+    status["remaining"] = max(limit - total, 0.0)
+    status["percent_used"] = round(total / limit * 100, 1) if limit else 0.0
+    status["over_limit"] = total > limit
+    return status
+
+
+def month_trend(db: Session, user_id: int, year: int, month: int, months: int) -> dict:
+    """Per-month, per-category totals for the `months` months ending at year/month."""
+    first_y, first_m = shift_month(year, month, -(months - 1))
+
+    buckets = {}
+    for i in range(months):
+        y, m = shift_month(first_y, first_m, i)
+        buckets[(y, m)] = {"year": y, "month": m, "total": 0, "expense_count": 0, "by_category": {}}
+
+    rows = rollup.range_totals(db, user_id, (first_y, first_m), (year, month)).all()
+    names = categories.cache.names(db, {row[2] for row in rows})
+    for y, m, category_id, amount, count in rows:
+        bucket = buckets[(y, m)]
+        bucket["by_category"][names[category_id]] = amount
+        bucket["total"] += amount
+        bucket["expense_count"] += count
+
+    return {
+        "monthly_limit": get_monthly_limit(db, user_id),
+        "months": list(buckets.values()),
+    }
+
+
+def dashboard(db: Session, user_id: int, year: int, month: int, recent: int) -> dict:
+    """What the dashboard first paints, minus the user: the budget (None until the user has
+    one), the month's budget status and its `recent` newest expenses. Three queries."""
+    budget = get_budget(db, user_id)
+    limit = budget.monthly_limit if budget else DEFAULT_MONTHLY_LIMIT
+    expenses, _ = list_expenses_page(db, user_id, recent, None, month=month, year=year)
+    return {
+        "budget": budget,
+        "summary": budget_status(db, user_id, year, month, limit),
+        "recent_expenses": expenses,
+    }
@@ -0,0 +1,218 @@
+"""Change notifications behind ``GET /stream/budget``.
+
+Every expense and budget write goes through ``crud.bump_data_version``, which calls
+``changed``. Once the write's transaction commits, ``broker`` wakes this process's streams
+for that user. On Postgres, ``changed`` also issues ``pg_notify`` inside the transaction,
+so other API processes hear about the commit: each runs a ``listener`` thread that LISTENs
+on CHANNEL and wakes its own streams. Notifications carry only the user id; streams re-read
+the budget status themselves.
+
+``account_deleted`` rides the same channel, so every process evicts a deleted account's
+cached tokens and categories as soon as the deletion commits.
+
+LISTEN needs a session-level connection. Behind PgBouncer in transaction-pooling mode,
+point DB_LISTEN_URL at the database directly.
+"""
+import asyncio
+import logging
+import os
+import select
+import socket
+import threading
+from typing import Optional
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+import auth
+import categories
+import config  # noqa: F401  (loads .env before the settings below are read)
+from database import DATABASE_URL
+
+logger = logging.getLogger("smartexpense.events")
+
+DB_LISTEN_URL = os.getenv("DB_LISTEN_URL", DATABASE_URL)
+
+CHANNEL = "budget_changes"
+# Last word of a notification's payload for a deleted account; changes have none.
+DELETED = "deleted"
+RECONNECT_SECONDS = 5.0
+HOSTNAME = socket.gethostname()
+# Session.info key for user ids whose data changed in the session's open transaction.
+_CHANGED = "events_changed"
+
+
+def _origin() -> str:
+    # Read per call: worker processes forked from a preloaded app share the import.
+    return f"{HOSTNAME}:{os.getpid()}"
+
+
+# ── In-process pub/sub ────────────────────────────────────────────────────────
+
+class Subscription:
+    """One open stream's wake-up flag. Several changes before the next wait count as one."""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def notify(self):
+        # Publishers run on worker threads as well as on the event loop.
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass  # the loop has shut down; the stream is gone
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for a change; False if `timeout` seconds passed without one."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+
+class Broker:
+    def __init__(self):
+        self._subscriptions = {}  # user_id -> set of Subscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """Register a stream for `user_id`. Call from the event loop."""
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id: int):
+        """Wake every stream of `user_id` in this process. Safe from any thread."""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def publish_all(self):
+        with self._lock:
+            subscriptions = [s for group in self._subscriptions.values() for s in group]
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._subscriptions),
+                "streams": sum(len(group) for group in self._subscriptions.values()),
+            }
+
+
+broker = Broker()
+
+
+def _notify(db: Session, *payload):
+    if db.get_bind().dialect.name == "postgresql":
+        # Delivered by Postgres at commit, and dropped on rollback.
+        db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                   {"channel": CHANNEL, "payload": " ".join(map(str, payload))})
+
+
+def changed(db: Session, user_id: int):
+    """Announce that `user_id`'s expenses or budget change when `db` commits. Does not commit."""
+    db.info.setdefault(_CHANGED, set()).add(user_id)
+    _notify(db, user_id, _origin())
+
+
+def account_deleted(db: Session, user_id: int):
+    """Tell the other API processes to forget `user_id` when `db` commits. Does not commit.
+
+    The caller evicts the account from this process's caches itself, after the commit.
+    """
+    _notify(db, user_id, _origin(), DELETED)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changed(session):
+    for user_id in session.info.pop(_CHANGED, ()):
+        broker.publish(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_changed(session, previous_transaction):
+    session.info.pop(_CHANGED, None)
+
+
+# ── Cross-process relay ───────────────────────────────────────────────────────
+
+def relay(payload: str, origin: str):
+    """Act on a notification from another process; this one's own (`origin`) are ignored."""
+    user_id, sender, *kind = payload.split(" ")
+    # This process already woke its own streams and evicted its caches at commit.
+    if sender == origin:
+        return
+    if kind == [DELETED]:
+        auth.invalidate_user(int(user_id))
+        categories.cache.forget_user(int(user_id))
+    else:
+        broker.publish(int(user_id))
+
+
+class Listener:
+    """Daemon thread passing other processes' NOTIFYs on CHANNEL to `relay`. Postgres only."""
+
+    def __init__(self, url: str = DB_LISTEN_URL):
+        self.url = url
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None or not self.url.startswith("postgresql"):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="events-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.warning("LISTEN %s failed; reconnecting in %ss", CHANNEL, RECONNECT_SECONDS, exc_info=True)
+                self._stop.wait(RECONNECT_SECONDS)
+
+    def _listen(self):
+        engine = create_engine(self.url, poolclass=NullPool)
+        conn = engine.raw_connection()
+        try:
+            raw = conn.driver_connection
+            raw.autocommit = True
+            raw.cursor().execute(f"LISTEN {CHANNEL}")
+            # Changes made while the connection was down were not heard; refresh every stream.
+            broker.publish_all()
+            origin = _origin()
+            while not self._stop.is_set():
+                if not select.select([raw], [], [], 1.0)[0]:
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    relay(raw.notifies.pop(0).payload, origin)
+        finally:
+            conn.close()
+            engine.dispose()
+
+
+listener = Listener()
@@ -0,0 +1,188 @@
+"""Streaming export of a user's expenses as CSV, NDJSON or Parquet.
+
+Rows are read with ``yield_per`` (a server-side cursor on Postgres) and encoded one
+partition at a time, so memory stays flat and the first bytes go out before the query has
+finished. Parquet support needs the optional ``pyarrow`` package.
+"""
+import csv
+import io
+import json
+from typing import AsyncIterator, Iterator
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import crud
+import models
+
+PARTITION_SIZE = 2000
+
+COLUMNS = ("id", "date", "amount", "category", "note", "created_at")
+
+
+def export_statement(user_id: int, **filters):
+    """Newest-first export query over the same filters as GET /expenses.
+
+    `filters` take a resolved ``category_id`` (see ``crud.category_filter``). Category names
+    come from a join, since the encoders only ever see rows.
+    """
+    columns = [
+        models.Category.name.label(c) if c == "category" else getattr(models.Expense, c) for c in COLUMNS
+    ]
+    stmt = select(*columns).join(models.Category, models.Category.id == models.Expense.category_id).where(
+        models.Expense.user_id == user_id
+    )
+    stmt = crud.filter_expenses(stmt, **filters)
+    stmt = stmt.order_by(models.Expense.date.desc(), models.Expense.id.desc())
+    return stmt.execution_options(yield_per=PARTITION_SIZE)
+
+
+# ── Encoders ──────────────────────────────────────────────────────────────────
+
+class CsvEncoder:
+    media_type = "text/csv"
+    extension = "csv"
+
+    def _dump(self, rows) -> bytes:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue().encode()
+
+    def header(self) -> bytes:
+        return self._dump([COLUMNS])
+
+    def encode(self, rows) -> bytes:
+        return self._dump(
+            (r.id, r.date.isoformat(), r.amount, r.category, r.note or "",
+             r.created_at.isoformat() if r.created_at else "")
+            for r in rows
+        )
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class NdjsonEncoder:
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, rows) -> bytes:
+        return "".join(
+            json.dumps({
+                "id": r.id,
+                "date": r.date.isoformat(),
+                "amount": r.amount,
+                "category": r.category,
+                "note": r.note or "",
+                "created_at": r.created_at.isoformat() if r.created_at else None,
+            }) + "\n"
+            for r in rows
+        ).encode()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _ByteSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after each Parquet row group."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ParquetEncoder:
+    """One Parquet row group per partition; the footer is written by `finish`."""
+
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+
+    def __init__(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([
+            ("id", pa.int64()),
+            ("date", pa.timestamp("us")),
+            ("amount", pa.float64()),
+            ("category", pa.string()),
+            ("note", pa.string()),
+            ("created_at", pa.timestamp("us")),
+        ])
+        self._sink = _ByteSink()
+        self._writer = pq.ParquetWriter(self._sink, self._schema)
+
+    def header(self) -> bytes:
+        return self._sink.drain()
+
+    def encode(self, rows) -> bytes:
+        columns = dict(zip(COLUMNS, zip(*rows)))
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+ENCODERS = {"csv": CsvEncoder, "ndjson": NdjsonEncoder, "parquet": ParquetEncoder}
+
+
+def make_encoder(fmt: str):
+    """Raises ImportError when the format's optional dependency is missing."""
+    return ENCODERS[fmt]()
+
+
+# ── Streaming ─────────────────────────────────────────────────────────────────
+#
+# The request's session has already been closed by the time the response body is
+# iterated (FastAPI runs dependency teardown before sending). A closed Session or
+# AsyncSession is reusable: it checks out a fresh connection on first use. The streams
+# below therefore reuse it and close it again when they finish.
+
+def stream_sync(db: Session, stmt, encoder) -> Iterator[bytes]:
+    try:
+        yield encoder.header()
+        for rows in db.execute(stmt).partitions():
+            yield encoder.encode(rows)
+        yield encoder.finish()
+    finally:
+        db.close()
+
+
+async def stream_async(db: AsyncSession, stmt, encoder) -> AsyncIterator[bytes]:
+    try:
+        yield encoder.header()
+        result = await db.stream(stmt)
+        async for rows in result.partitions():
+            yield encoder.encode(rows)
+        yield encoder.finish()
+    finally:
+        await db.close()
+
+
+def stream(db, stmt, encoder):
+    if isinstance(db, AsyncSession):
+        return stream_async(db, stmt, encoder)
+    return stream_sync(db, stmt, encoder)
@@ -0,0 +1,233 @@
+"""End-of-month spending forecast and budget burn rate, vectorized with NumPy.
+
+Daily per-category totals for the trailing LOOKBACK_DAYS are loaded as one
+(users, categories, days) array. The projection is then computed for all users and
+categories at once:
+
+* the base rate per category is the mean daily spend over the last RATE_WINDOW active days;
+* day-of-week factors scale that rate (weekend-heavy categories project higher on weekends),
+  shrunk towards 1 while only a few weeks have been observed;
+* remaining days of the month are projected as rate x factor and accumulated on top of
+  month-to-date spend to find the day the budget is (or was) exceeded.
+
+The API serves one user at a time; the CLI scores every user in chunks for offline jobs:
+
+    python forecast.py score [--as-of 2024-05-15] [--user-id N ...] > forecast.csv
+"""
+import argparse
+import calendar
+import csv
+import sys
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import categories
+import crud
+import models
+
+LOOKBACK_DAYS = 84
+RATE_WINDOW = 28
+# Pseudo-observations of "no weekday effect" blended into each weekday factor.
+SEASONALITY_PRIOR = 4.0
+SCORE_CHUNK = 500
+
+
+# ── Data ──────────────────────────────────────────────────────────────────────
+
+def daily_totals(db: Session, user_ids: list, start: date, end: date):
+    """Return (names, array) where array[u, c, d] is user_ids[u]'s spend in category names[c] on start + d.
+
+    `end` is exclusive. One grouped query for all users; on Postgres it is an index-only
+    scan of ix_expenses_user_date_id.
+    """
+    day = func.date(models.Expense.date)
+    rows = db.execute(
+        select(models.Expense.user_id, day, models.Expense.category_id, func.sum(models.Expense.amount))
+        .where(
+            models.Expense.user_id.in_(user_ids),
+            models.Expense.date >= datetime.combine(start, datetime.min.time()),
+            models.Expense.date < datetime.combine(end, datetime.min.time()),
+        )
+        .group_by(models.Expense.user_id, day, models.Expense.category_id)
+    ).all()
+
+    # Ordered by name. Different users' custom categories may share a name; they share a slot too.
+    id_names = categories.cache.names(db, {category_id for _, _, category_id, _ in rows})
+    names = sorted(set(id_names.values()))
+    user_index = {uid: i for i, uid in enumerate(user_ids)}
+    name_index = {name: i for i, name in enumerate(names)}
+    totals = np.zeros((len(user_ids), len(names), (end - start).days))
+    if rows:
+        uid, days, category_id, amount = zip(*rows)
+        # SQLite's date() returns text, Postgres a date.
+        offsets = [
+            ((d if isinstance(d, date) else date.fromisoformat(d)) - start).days for d in days
+        ]
+        np.add.at(
+            totals,
+            ([user_index[u] for u in uid], [name_index[id_names[c]] for c in category_id], offsets),
+            np.asarray(amount, dtype=float),
+        )
+    return names, totals
+
+
+def monthly_limits(db: Session, user_ids: list) -> np.ndarray:
+    limits = dict(db.execute(
+        select(models.Budget.user_id, models.Budget.monthly_limit).where(models.Budget.user_id.in_(user_ids))
+    ).all())
+    return np.array([limits.get(uid, crud.DEFAULT_MONTHLY_LIMIT) for uid in user_ids], dtype=float)
+
+
+# ── Model ─────────────────────────────────────────────────────────────────────
+
+def project(totals: np.ndarray, start: date, as_of: date, limits: np.ndarray) -> dict:
+    """Forecast the rest of as_of's month from `totals` (users, categories, days through as_of).
+
+    Returns arrays with a leading users axis; see the module docstring for the model.
+    """
+    users, _, days = totals.shape
+    weekdays = (start.weekday() + np.arange(days)) % 7
+    month_start = (as_of.replace(day=1) - start).days
+    month_days = calendar.monthrange(as_of.year, as_of.month)[1]
+    remaining = month_days - as_of.day
+
+    # Days before a user's first expense in the window are not evidence of zero spending.
+    spent_any = totals.sum(axis=1) > 0                                           # (U, N)
+    first = np.where(spent_any.any(axis=1), spent_any.argmax(axis=1), days - 1)  # (U,)
+    active = np.arange(days)[None, :] >= first[:, None]                          # (U, N)
+    active_days = days - first                                                   # (U,)
+
+    # Rolling base rate: mean over the last min(RATE_WINDOW, active days) days.
+    window = np.minimum(active_days, RATE_WINDOW)
+    cumulative = np.concatenate([np.zeros(totals.shape[:2] + (1,)), totals.cumsum(axis=2)], axis=2)
+    window_start = np.broadcast_to((days - window)[:, None, None], totals.shape[:2] + (1,))
+    in_window = cumulative[:, :, -1] - np.take_along_axis(cumulative, window_start, axis=2)[:, :, 0]
+    rate = in_window / window[:, None]                                           # (U, C)
+
+    # Day-of-week factors: mean spend on each weekday relative to the overall daily mean.
+    onehot = (weekdays[None, :, None] == np.arange(7)) & active[:, :, None]      # (U, N, 7)
+    observed = onehot.sum(axis=1)                                                # (U, 7)
+    by_weekday = np.einsum("ucn,unw->ucw", totals, onehot)                       # (U, C, 7)
+    overall = totals.sum(axis=2) / active_days[:, None]                          # (U, C)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        raw = by_weekday / observed[:, None, :] / overall[:, :, None]
+    raw = np.where(np.isfinite(raw), raw, 1.0)
+    factors = (observed[:, None, :] * raw + SEASONALITY_PRIOR) / (observed[:, None, :] + SEASONALITY_PRIOR)
+
+    future_weekdays = (as_of.weekday() + 1 + np.arange(remaining)) % 7
+    projected = rate[:, :, None] * factors[:, :, future_weekdays]               # (U, C, R)
+
+    month_actual = totals[:, :, month_start:]                                    # (U, C, as_of.day)
+    spent = month_actual.sum(axis=2)                                             # (U, C)
+    actual_path = month_actual.sum(axis=1).cumsum(axis=1)                        # (U, as_of.day)
+    path = np.concatenate([actual_path, actual_path[:, -1:] + projected.sum(axis=1).cumsum(axis=1)], axis=1)
+    over = path > limits[:, None]
+    exceeds_day = np.where(over.any(axis=1), over.argmax(axis=1) + 1, 0)        # day of month, 0 = never
+
+    return {
+        "rate": rate,
+        "factors": factors,
+        "spent": spent,
+        "projected_remaining": projected.sum(axis=2),
+        "daily_actual": month_actual.sum(axis=1),
+        "daily_projected": projected.sum(axis=1),
+        "path": path,
+        "exceeds_day": exceeds_day,
+    }
+
+
+def _window(as_of: date):
+    return as_of - timedelta(days=LOOKBACK_DAYS - 1), as_of + timedelta(days=1)
+
+
+# ── Entry points ──────────────────────────────────────────────────────────────
+
+def forecast_user(db: Session, user_id: int, as_of: date) -> dict:
+    start, end = _window(as_of)
+    names, totals = daily_totals(db, [user_id], start, end)
+    limit = monthly_limits(db, [user_id])
+    result = project(totals, start, as_of, limit)
+
+    month_days = calendar.monthrange(as_of.year, as_of.month)[1]
+    spent = float(result["spent"][0].sum())
+    projected_total = spent + float(result["projected_remaining"][0].sum())
+    exceeds_day = int(result["exceeds_day"][0])
+    daily = [
+        {"date": as_of.replace(day=d + 1).isoformat(), "actual": round(float(v), 2), "projected": None,
+         "cumulative": round(float(result["path"][0, d]), 2)}
+        for d, v in enumerate(result["daily_actual"][0])
+    ] + [
+        {"date": as_of.replace(day=as_of.day + d + 1).isoformat(), "actual": None,
+         "projected": round(float(v), 2), "cumulative": round(float(result["path"][0, as_of.day + d]), 2)}
+        for d, v in enumerate(result["daily_projected"][0])
+    ]
+    return {
+        "as_of": as_of.isoformat(),
+        "month": as_of.month,
+        "year": as_of.year,
+        "days_in_month": month_days,
+        "days_elapsed": as_of.day,
+        "monthly_limit": float(limit[0]),
+        "spent": round(spent, 2),
+        "projected_total": round(projected_total, 2),
+        "projected_over_by": round(max(projected_total - float(limit[0]), 0.0), 2),
+        "exceeds_on": as_of.replace(day=exceeds_day).isoformat() if exceeds_day else None,
+        "categories": [
+            {
+                "category": category,
+                "spent": round(float(result["spent"][0, c]), 2),
+                "daily_rate": round(float(result["rate"][0, c]), 2),
+                "projected_total": round(float(result["spent"][0, c] + result["projected_remaining"][0, c]), 2),
+                "weekday_factors": [round(float(f), 3) for f in result["factors"][0, c]],
+            }
+            for c, category in enumerate(names)
+        ],
+        "daily": daily,
+    }
+
+
+def score_users(db: Session, as_of: date, user_ids: Optional[list] = None, chunk: int = SCORE_CHUNK) -> Iterator[dict]:
+    """Yield one summary row per user, scoring SCORE_CHUNK users per query and projection."""
+    if user_ids is None:
+        user_ids = db.scalars(select(models.User.id).order_by(models.User.id)).all()
+    start, end = _window(as_of)
+    for i in range(0, len(user_ids), chunk):
+        ids = list(user_ids[i:i + chunk])
+        _, totals = daily_totals(db, ids, start, end)
+        limits = monthly_limits(db, ids)
+        result = project(totals, start, as_of, limits)
+        spent = result["spent"].sum(axis=1)
+        projected = spent + result["projected_remaining"].sum(axis=1)
+        for u, uid in enumerate(ids):
+            day = int(result["exceeds_day"][u])
+            yield {
+                "user_id": uid,
+                "monthly_limit": round(float(limits[u]), 2),
+                "spent": round(float(spent[u]), 2),
+                "projected_total": round(float(projected[u]), 2),
+                "exceeds_on": as_of.replace(day=day).isoformat() if day else "",
+            }
+
+
+def main(argv=None) -> int:
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["score"])
+    parser.add_argument("--as-of", type=date.fromisoformat, default=date.today())
+    parser.add_argument("--user-id", type=int, action="append", dest="user_ids")
+    args = parser.parse_args(argv)
+
+    writer = csv.DictWriter(sys.stdout, ["user_id", "monthly_limit", "spent", "projected_total", "exceeds_on"])
+    writer.writeheader()
+    with SessionLocal() as db:
+        writer.writerows(score_users(db, args.as_of, args.user_ids))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
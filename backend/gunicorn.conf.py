@@ -0,0 +1,76 @@
+"""Production server settings: gunicorn managing uvicorn workers.
+
+    gunicorn            # run from backend/; gunicorn reads this file from the working directory
+
+The app is imported once in the master (``preload_app``) and each worker is forked from
+it, so a broken deploy fails before any worker starts and the workers share the imported
+code's memory. Importing the app opens no connections; each worker warms its own pool and
+starts its own job threads and LISTEN connection in the app's lifespan.
+
+Every worker has its own connection pools, so the database sees WEB_CONCURRENCY times the
+per-process connection count; the master logs the total at startup (see README).
+"""
+import os
+
+# Not ``import config``: gunicorn would read the module as its own "config" setting.
+# database imports it, which loads .env before the settings below are read.
+import database
+import events
+
+
+def cpu_count() -> int:
+    """CPUs this process may use: the cgroup v2 quota when the container has one, else the
+    affinity mask. os.cpu_count() reports the host's CPUs inside a container."""
+    cpus = len(os.sched_getaffinity(0))
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        return cpus
+    if quota == "max":
+        return cpus
+    return max(1, min(cpus, int(int(quota) / int(period))))
+
+
+# One async worker per CPU: each already serves many requests at once on its event loop.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(cpu_count())))
+# Restart a worker after this many requests (0 = never), give or take the jitter, so slow
+# memory growth is reclaimed and workers do not all restart at once.
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "10000"))
+WEB_MAX_REQUESTS_JITTER = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "1000"))
+# Seconds a worker gets after SIGTERM (deploys, recycling) before it is killed.
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+
+
+wsgi_app = "main:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = WEB_CONCURRENCY
+preload_app = True
+max_requests = WEB_MAX_REQUESTS
+max_requests_jitter = WEB_MAX_REQUESTS_JITTER
+graceful_timeout = WEB_GRACEFUL_TIMEOUT
+# A worker whose event loop stops answering gunicorn's heartbeat this long is restarted.
+timeout = 60
+keepalive = 5
+accesslog = "-"
+
+
+def when_ready(server):
+    per_worker = database.peak_connections()
+    if per_worker is None:
+        return
+    # Plus the connection each worker LISTENs on for live budget updates.
+    per_worker += 1 if events.DB_LISTEN_URL.startswith("postgresql") else 0
+    server.log.info(
+        "%d workers x up to %d connections each: up to %d connections to the primary",
+        workers, per_worker, workers * per_worker,
+    )
+
+
+def post_fork(server, worker):
+    database.dispose_after_fork()
+    # Requests still open this long after SIGTERM are cancelled, /stream/budget included
+    # (clients reconnect to another worker), leaving the rest of graceful_timeout for the
+    # lifespan shutdown: stopping job threads and closing pools.
+    worker.config.timeout_graceful_shutdown = max(graceful_timeout - 10, 1)
@@ -0,0 +1,229 @@
+"""Streaming bulk import of bank statements (CSV or OFX) into expenses.
+
+Files are parsed incrementally and validated in fixed-size chunks, so memory use depends on
+the chunk size rather than on the file size. Each chunk of valid rows is written with one
+multi-row INSERT plus one rollup upsert per (month, category) bucket it touches.
+"""
+import codecs
+import csv
+import re
+from datetime import datetime
+from typing import IO, Iterator, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import categories
+import crud
+import models
+import rollup
+import schemas
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+DEFAULT_CATEGORY = "Other"
+
+# Accepted CSV header names (case-insensitive) for each ExpenseCreate field.
+CSV_COLUMNS = {
+    "date": ("date", "posted", "transaction date", "booking date"),
+    "amount": ("amount", "value"),
+    "category": ("category",),
+    "note": ("note", "description", "memo", "details", "payee"),
+}
+
+
+# Tried in turn on each CSV line. Bank exports are often cp1252; latin-1 decodes anything.
+CSV_ENCODINGS = ("utf-8", "cp1252", "latin-1")
+
+
+class MalformedFile(ValueError):
+    """The file cannot be parsed at all, as opposed to rows that fail validation."""
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def detect_format(filename: Optional[str], explicit: Optional[str] = None) -> str:
+    fmt = (explicit or (filename or "").rsplit(".", 1)[-1]).lower()
+    if fmt in ("ofx", "qfx"):
+        return "ofx"
+    if fmt == "csv":
+        return "csv"
+    raise ValueError("Unsupported file format; upload a .csv or .ofx file")
+
+
+# ── Parsers ───────────────────────────────────────────────────────────────────
+
+def _decode_lines(fileobj: IO[bytes]) -> Iterator[str]:
+    for number, line in enumerate(fileobj):
+        if number == 0:
+            line = line.removeprefix(codecs.BOM_UTF8)
+        for encoding in CSV_ENCODINGS:
+            try:
+                yield line.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+
+
+def _csv_rows(reader) -> Iterator[list]:
+    while True:
+        try:
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error as exc:
+            raise MalformedFile(f"Line {reader.line_num}: {exc}") from None
+
+
+def iter_csv(fileobj: IO[bytes]) -> Iterator[tuple]:
+    """Yield (line_number, fields) for each data row of a CSV file.
+
+    Lines that are not UTF-8 are read as cp1252. Raises MalformedFile when the CSV
+    structure itself is broken.
+    """
+    reader = csv.reader(_decode_lines(fileobj))
+    rows = _csv_rows(reader)
+    header = next(rows, None)
+    if header is None:
+        return
+    names = [h.strip().lower() for h in header]
+    columns = {}
+    for field, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                columns[field] = names.index(alias)
+                break
+    for values in rows:
+        if not any(v.strip() for v in values):
+            continue
+        fields = {
+            field: values[i].strip() for field, i in columns.items() if i < len(values)
+        }
+        yield reader.line_num, fields
+
+
+_OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+def _ofx_date(value: str) -> str:
+    # YYYYMMDD[HHMMSS[.XXX]][[TZ]] → ISO 8601 without the zone suffix.
+    digits = value[:14]
+    if len(digits) >= 14:
+        return datetime.strptime(digits, "%Y%m%d%H%M%S").isoformat()
+    return datetime.strptime(value[:8], "%Y%m%d").isoformat()
+
+
+def iter_ofx(fileobj: IO[bytes], read_size: int = 64 * 1024) -> Iterator[tuple]:
+    """Yield (transaction_number, fields) for each debit <STMTTRN> of an OFX/QFX file.
+
+    Handles both SGML (OFX 1.x, unclosed leaf tags) and XML (OFX 2.x) statements.
+    Credits are not expenses and are skipped.
+    """
+    decoder = codecs.getincrementaldecoder("latin-1")()
+    buffer = ""
+    current = None
+    number = 0
+    while True:
+        chunk = fileobj.read(read_size)
+        buffer += decoder.decode(chunk or b"", final=not chunk)
+        # Only consume up to the last complete tag; the remainder may continue in the next read.
+        cut = len(buffer) if not chunk else max(buffer.rfind("<"), 0)
+        for closing, tag, text in _OFX_TAG.findall(buffer[:cut]):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if not closing:
+                    current = {}
+                elif current is not None:
+                    number += 1
+                    fields = _ofx_fields(current)
+                    if fields is not None:
+                        yield number, fields
+                    current = None
+            elif current is not None and not closing and text.strip():
+                current[tag] = text.strip()
+        buffer = buffer[cut:]
+        if not chunk:
+            break
+
+
+def _ofx_fields(trn: dict) -> Optional[dict]:
+    try:
+        amount = float(trn.get("TRNAMT", ""))
+    except ValueError:
+        return {"amount": trn.get("TRNAMT"), "date": trn.get("DTPOSTED"), "category": ""}
+    if amount >= 0:
+        return None
+    note = " ".join(v for v in (trn.get("NAME"), trn.get("MEMO")) if v)
+    try:
+        date = _ofx_date(trn.get("DTPOSTED", ""))
+    except ValueError:
+        date = trn.get("DTPOSTED")
+    return {"amount": -amount, "date": date, "category": "", "note": note}
+
+
+# ── Validation and insert ─────────────────────────────────────────────────────
+
+def chunks(rows: Iterator[tuple], report: ImportReport, size: int = CHUNK_SIZE) -> Iterator[list]:
+    """Validate `rows` against ExpenseCreate, yielding lists of at most `size` valid dicts.
+
+    Amounts must be positive, as OFX debits are once converted: a CSV that writes debits
+    as negative numbers, or mixes in credits, would otherwise count refunds and income
+    against the budget. Invalid rows are recorded on `report` and dropped.
+    """
+    valid = []
+    for row_number, fields in rows:
+        fields["category"] = fields.get("category") or DEFAULT_CATEGORY
+        try:
+            expense = schemas.ExpenseCreate.model_validate(fields)
+        except ValidationError as exc:
+            err = exc.errors()[0]
+            report.add_error(row_number, f"{'.'.join(map(str, err['loc']))}: {err['msg']}")
+            continue
+        if expense.amount <= 0:
+            report.add_error(row_number, "amount: Input should be greater than 0 (credits are not imported)")
+            continue
+        valid.append(expense.model_dump())
+        if len(valid) >= size:
+            yield valid
+            valid = []
+    if valid:
+        yield valid
+
+
+def insert_chunk(db: Session, user_id: int, rows: list) -> int:
+    """Insert validated rows and fold them into the rollup. Does not commit.
+
+    Category names are resolved once per distinct name in the chunk; unknown ones become
+    the user's custom categories.
+    """
+    ids = categories.cache.resolve_many(db, user_id, (row["category"] for row in rows))
+    for row in rows:
+        row["user_id"] = user_id
+        row["category_id"] = ids[row.pop("category")]
+    db.execute(insert(models.Expense), rows)
+
+    deltas = rollup.Deltas()
+    for row in rows:
+        deltas.add(row["date"], row["category_id"], row["amount"])
+    deltas.flush(db, user_id)
+    crud.bump_data_version(db, user_id)
+    return len(rows)
@@ -0,0 +1,347 @@
+"""Background jobs for work too slow for a request: large imports, rollup rebuilds, account deletion.
+
+The ``jobs`` table is both the queue and the status record. The API enqueues a row and
+returns 202 with its id; clients poll ``GET /jobs/{id}`` for status and progress.
+
+Each API process runs JOB_WORKERS daemon threads (0 disables them). A thread claims the
+oldest queued job with a conditional UPDATE, so several processes can share one table
+without running a job twice. Handlers run on their own sync session and report progress
+as they go, which also refreshes the job's heartbeat. A job left "running" with a
+heartbeat older than JOB_STALE_SECONDS belongs to a worker that died; it is marked
+failed rather than retried, since handlers are not idempotent.
+
+    python jobs.py run      # a standalone worker process, instead of or besides the API's
+"""
+import argparse
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+import auth
+import categories
+import config  # noqa: F401  (loads .env before the settings below are read)
+import crud
+import events
+import importer
+import models
+import partitions
+import rollup
+
+logger = logging.getLogger("smartexpense.jobs")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Idle workers wake up this often; enqueueing in the same process wakes them at once.
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "900"))
+# Uploads for background imports are spooled here and read back by a worker on this host.
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", tempfile.gettempdir())
+
+# Progress is written at most this often, plus once when a job finishes.
+PROGRESS_INTERVAL = 1.0
+DELETE_BATCH = 5000
+HOSTNAME = socket.gethostname()
+
+Job = models.Job
+
+
+# ── Handlers ──────────────────────────────────────────────────────────────────
+
+@dataclass
+class JobContext:
+    id: str
+    user_id: Optional[int]
+    params: dict
+    report: Optional[Callable] = None
+    done: int = 0
+    total: Optional[int] = None
+    _reported_at: float = field(default=0.0, repr=False)
+
+    def progress(self, done: int, total: Optional[int] = None):
+        """Record progress; persisted (throttled) through `report` when one is set."""
+        self.done = done
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if self.report is not None and now - self._reported_at >= PROGRESS_INTERVAL:
+            self._reported_at = now
+            self.report(self.id, self.done, self.total)
+
+
+HANDLERS = {}
+
+
+def handler(kind: str):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+@handler("import")
+def run_import(db: Session, ctx: JobContext) -> dict:
+    """Import a spooled statement file; progress is in bytes read. Commits once at the end."""
+    path = ctx.params["path"]
+    parse = importer.iter_ofx if ctx.params["format"] == "ofx" else importer.iter_csv
+    report = importer.ImportReport()
+    try:
+        size = os.path.getsize(path)
+        ctx.progress(0, size)
+        with open(path, "rb") as f:
+            for rows in importer.chunks(parse(f), report):
+                report.imported += importer.insert_chunk(db, ctx.user_id, rows)
+                ctx.progress(f.tell())
+        db.commit()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return report.as_dict()
+
+
+@handler("rollup_rebuild")
+def run_rollup_rebuild(db: Session, ctx: JobContext) -> dict:
+    buckets = rollup.rebuild(db, ctx.user_id)
+    crud.bump_data_version(db, ctx.user_id)
+    db.commit()
+    return {"buckets": buckets}
+
+
+@handler("delete_account")
+def run_delete_account(db: Session, ctx: JobContext) -> dict:
+    """Delete a user and everything they own.
+
+    Expenses go in DELETE_BATCH-row transactions so no single statement holds locks on a
+    whole account; archived expenses, the rollup, budget, custom categories and user row go
+    last, in one transaction.
+    """
+    uid = ctx.user_id
+    owned = select(models.Expense.id).where(models.Expense.user_id == uid)
+    total = db.scalar(select(func.count()).select_from(owned.subquery()))
+    deleted = 0
+    ctx.progress(0, total)
+    while ids := db.scalars(owned.limit(DELETE_BATCH)).all():
+        db.execute(delete(models.Expense).where(models.Expense.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+        ctx.progress(min(deleted, total), total)
+
+    # Rows added between the count and the last batch.
+    deleted += db.execute(delete(models.Expense).where(models.Expense.user_id == uid)).rowcount
+    deleted += partitions.purge_user(db, uid)
+    for model in (models.MonthlyCategoryTotal, models.Budget, models.Category):
+        db.execute(delete(model).where(model.user_id == uid))
+    db.execute(delete(models.User).where(models.User.id == uid))
+    events.account_deleted(db, uid)
+    db.commit()
+    # Other API processes evict theirs when the notification arrives (events.py).
+    auth.invalidate_user(uid)
+    categories.cache.forget_user(uid)
+    return {"deleted_expenses": deleted}
+
+
+# ── Queue ─────────────────────────────────────────────────────────────────────
+
+def enqueue(db: Session, kind: str, user_id: Optional[int], params: Optional[dict] = None,
+            affinity: Optional[str] = None) -> models.Job:
+    """Insert a queued job and commit. Call `runner.notify()` afterwards to start it promptly."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job(
+        id=uuid.uuid4().hex, kind=kind, user_id=user_id, params=params or {},
+        affinity=affinity, status="queued", done=0, created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_job(db: Session, user_id: int, job_id: str) -> Optional[models.Job]:
+    return db.query(Job).filter(Job.id == job_id, Job.user_id == user_id).first()
+
+
+def spool_path() -> str:
+    return os.path.join(JOB_SPOOL_DIR, f"smartexpense-import-{uuid.uuid4().hex}")
+
+
+def claim(db: Session, worker: str) -> Optional[models.Job]:
+    """Move the oldest runnable queued job to "running" and return it, or None.
+
+    The UPDATE only matches while the row is still queued, so when two workers pick the
+    same candidate exactly one of them gets rowcount 1.
+    """
+    candidates = db.scalars(
+        select(Job.id)
+        .where(Job.status == "queued", or_(Job.affinity.is_(None), Job.affinity == HOSTNAME))
+        .order_by(Job.created_at)
+        .limit(5)
+    ).all()
+    for job_id in candidates:
+        now = datetime.utcnow()
+        claimed = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "queued")
+            .values(status="running", locked_by=worker, started_at=now, heartbeat_at=now)
+        ).rowcount
+        db.commit()
+        if claimed:
+            return db.get(Job, job_id)
+    return None
+
+
+def execute(db: Session, job: models.Job, report: Optional[Callable] = None) -> str:
+    """Run a claimed job to completion and record the outcome. Returns the final status."""
+    job_id = job.id
+    ctx = JobContext(job_id, job.user_id, dict(job.params or {}), report)
+    try:
+        result = HANDLERS[job.kind](db, ctx)
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Job %s (%s) failed", job_id, job.kind)
+        status, result, error = "failed", None, f"{type(exc).__name__}: {exc}"
+    else:
+        status, error = "succeeded", None
+        if ctx.total is not None:
+            ctx.done = ctx.total
+    now = datetime.utcnow()
+    db.execute(
+        update(Job).where(Job.id == job_id).values(
+            status=status, result=result, error=error, done=ctx.done, total=ctx.total,
+            finished_at=now, heartbeat_at=now,
+        )
+    )
+    db.commit()
+    return status
+
+
+def fail_stale(db: Session, stale_after: float = JOB_STALE_SECONDS) -> int:
+    """Mark running jobs whose worker stopped heartbeating as failed. Returns how many."""
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    count = db.execute(
+        update(Job)
+        .where(Job.status == "running", Job.heartbeat_at < cutoff)
+        .values(status="failed", error="interrupted: worker stopped responding", finished_at=datetime.utcnow())
+    ).rowcount
+    db.commit()
+    return count
+
+
+def run_pending(db: Session, worker: str = "inline", report: Optional[Callable] = None) -> int:
+    """Run queued jobs on `db` until none are left. Returns how many ran."""
+    ran = 0
+    while (job := claim(db, worker)) is not None:
+        execute(db, job, report)
+        ran += 1
+    return ran
+
+
+# ── Runner ────────────────────────────────────────────────────────────────────
+
+class JobRunner:
+    """Worker threads polling the queue. Each thread uses its own session from `session_factory`."""
+
+    def __init__(self, workers: int = JOB_WORKERS, session_factory=None):
+        self.workers = workers
+        self.session_factory = session_factory
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._reaped_at = 0.0
+
+    def _sessions(self):
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory
+
+    def _report(self, job_id: str, done: int, total: Optional[int]):
+        # Separate session and transaction: the handler's own may be mid-way and uncommitted.
+        try:
+            with self._sessions()() as db:
+                db.execute(
+                    update(Job).where(Job.id == job_id)
+                    .values(done=done, total=total, heartbeat_at=datetime.utcnow())
+                )
+                db.commit()
+        except Exception:
+            logger.warning("Could not record progress for job %s", job_id, exc_info=True)
+
+    def run_next(self, worker: str) -> bool:
+        """Claim and run one job. Returns False when the queue had nothing for this host."""
+        with self._sessions()() as db:
+            if time.monotonic() - self._reaped_at >= 60:
+                self._reaped_at = time.monotonic()
+                if stale := fail_stale(db):
+                    logger.warning("Marked %d stale job(s) as failed", stale)
+            job = claim(db, worker)
+            if job is None:
+                return False
+            execute(db, job, self._report)
+            return True
+
+    def _loop(self, worker: str):
+        while not self._stop.is_set():
+            try:
+                if self.run_next(worker):
+                    continue
+            except Exception:
+                logger.exception("Job worker %s hit an error polling the queue", worker)
+            self._wake.wait(JOB_POLL_INTERVAL)
+            self._wake.clear()
+
+    def start(self):
+        if self._threads or self.workers <= 0:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            name = f"{HOSTNAME}:{os.getpid()}:{i}"
+            thread = threading.Thread(target=self._loop, args=(name,), name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0):
+        """Ask workers to stop after their current job. Jobs still running are left to the reaper."""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+runner = JobRunner()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    worker = JobRunner(args.workers)
+    worker.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        worker.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,73 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from datetime import date, datetime
 from typing import Optional, List
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import shutil
 import uvicorn
 
-from database import get_db, engine
-import models
+import config  # noqa: F401  (loads .env before the settings below are read)
+from database import (
+    READ_PRIMARY_HEADER, ReadYourWritesMiddleware, all_pool_stats, dispose_engines, get_db, ping,
+    replica_session, replica_sessionmaker, run_db, warm_pool,
+)
+import crud
+import events
 import schemas
 import auth
+import categories
+import importer
+import exporter
+import forecast
+import jobs
+import metrics
+import partitions
+
+logger = logging.getLogger("smartexpense")
+
+# Upper bound on the startup warm-up and on each /readyz database check.
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "5"))
+# Bearer token for /stats and /metrics; unset, both answer 404.
+OPS_TOKEN = os.getenv("OPS_TOKEN", "")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Importing this module does no IO; connections are opened here. A database that is
+    # down at boot must not kill the worker: it starts unready and /readyz retries.
+    app.state.warm = False
+    try:
+        await asyncio.wait_for(warm_pool(), PROBE_TIMEOUT)
+        app.state.warm = True
+    except Exception:
+        logger.warning("Could not warm the database pool at startup; /readyz will retry", exc_info=True)
+    # Best effort and bounded like the warm-up: a slow database must not hold up boot (and
+    # get the worker killed by its process manager). The daily partitions.py ensure covers it.
+    if app.state.warm:
+        try:
+            await asyncio.wait_for(run_in_threadpool(partitions.ensure_on_startup), PROBE_TIMEOUT)
+        except Exception:
+            logger.warning("Could not create upcoming expense partitions; run partitions.py ensure", exc_info=True)
+    else:
+        logger.warning("Database not ready; skipped creating upcoming expense partitions")
+    jobs.runner.start()
+    events.listener.start()
+    yield
+    await run_in_threadpool(events.listener.stop)
+    await run_in_threadpool(jobs.runner.stop)
+    await dispose_engines()
 
-models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="SmartExpense API", version="1.0.0")
+app = FastAPI(title="SmartExpense API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,200 +75,575 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", READ_PRIMARY_HEADER],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(ReadYourWritesMiddleware, sign=auth.read_primary_token)
 
 security = HTTPBearer()
 
-def get_current_user(
+
+@app.exception_handler(auth.HashPoolFull)
+async def hash_pool_full_handler(request: Request, exc: auth.HashPoolFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many sign-in requests, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+# Route handlers are coroutines; all database work goes through run_db(db, crud.<fn>, ...)
+# so it never blocks the event loop, whichever session type get_db provides.
+
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def wrote_recently(request: Request, user_id: Optional[int]) -> bool:
+    """Whether the client says (with a signed READ_PRIMARY_HEADER) that it just wrote."""
+    return user_id is not None and auth.reads_primary(request.headers.get(READ_PRIMARY_HEADER), user_id)
+
+
+async def get_current_user(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-):
+    db=Depends(get_db),
+) -> auth.CachedUser:
     token = credentials.credentials
-    email = auth.verify_token(token)
-    if not email:
+    cached = auth.token_cache.get(token)
+    if cached is not None:
+        # Another worker may have deleted the account since; a write would then fail on its
+        # foreign keys. Reads may serve the cached user for up to TOKEN_CACHE_TTL (auth.py).
+        if request.method in SAFE_METHODS or await run_db(db, crud.user_exists, cached.id):
+            return cached
+        auth.invalidate_user(cached.id)
+        raise HTTPException(status_code=401, detail="User not found")
+    claims = auth.verify_token(token)
+    if not claims:
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = None
+    uid = claims.get("uid")
+    if (factory := replica_sessionmaker(uid, wrote_recently(request, uid))) is not None:
+        async with replica_session(factory) as replica:
+            user = await run_db(replica, crud.get_user_for_claims, claims)
+    if not user:
+        # No replica, or the account is too new to have reached it.
+        user = await run_db(db, crud.get_user_for_claims, claims)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
+    return auth.cache_user(token, claims, user)
+
+
+async def get_read_db(
+    request: Request,
+    current_user: auth.CachedUser = Depends(get_current_user),
+    db=Depends(get_db),
+):
+    """Session for read-only routes: a replica, or the primary (`get_db`'s session) when
+    no replica is configured or the caller wrote moments ago. See database.py."""
+    factory = replica_sessionmaker(current_user.id, wrote_recently(request, current_user.id))
+    if factory is None:
+        yield db
+        return
+    async with replica_session(factory) as replica:
+        yield replica
+
+
+# ── Conditional GETs ──────────────────────────────────────────────────────────
+#
+# Every expense and budget write bumps users.data_version, so (user, version, URL) names a
+# response exactly. The version is read *before* the data: a write landing in between
+# yields a stale tag on fresh data, which only costs the client one extra 200 later.
+
+def _etag(user_id: int, version: int, request: Request, *extra) -> str:
+    raw = "|".join(map(str, (app.version, user_id, version, request.url.path, request.url.query, *extra)))
+    return f'W/"{hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # If-None-Match uses weak comparison.
+    return "*" in tags or etag.removeprefix("W/") in (t.removeprefix("W/") for t in tags)
+
+
+async def not_modified(request: Request, response: Response, db, user_id: int, *extra) -> Optional[Response]:
+    """Return a 304 if the client's copy is current, else set ETag headers on `response`.
+
+    `extra` carries inputs the URL does not, such as the month an endpoint defaults to.
+    """
+    version = await run_db(db, crud.get_data_version, user_id)
+    headers = {"ETag": _etag(user_id, version, request, *extra), "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
 
 
 # ── Auth ──────────────────────────────────────────────────────────────────────
 
 @app.post("/auth/register", response_model=schemas.Token)
-def register(payload: schemas.UserCreate, db: Session = Depends(get_db)):
-    if db.query(models.User).filter(models.User.email == payload.email).first():
+async def register(payload: schemas.UserCreate, db=Depends(get_db)):
+    if await run_db(db, crud.get_user_by_email, payload.email):
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = models.User(
-        email=payload.email,
-        name=payload.name,
-        hashed_password=auth.hash_password(payload.password),
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    token = auth.create_token(user.email)
+    hashed = await auth.hash_password_async(payload.password)
+    user = await run_db(db, crud.create_user, payload.email, payload.name, hashed)
+    token = auth.create_token(user.email, user.id)
     return {"access_token": token, "token_type": "bearer", "user": user}
 
 
 @app.post("/auth/login", response_model=schemas.Token)
-def login(payload: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == payload.email).first()
-    if not user or not auth.verify_password(payload.password, user.hashed_password):
+async def login(payload: schemas.UserLogin, db=Depends(get_db)):
+    user = await run_db(db, crud.get_user_by_email, payload.email)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await auth.verify_and_update_password_async(payload.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = auth.create_token(user.email)
+    if new_hash:
+        await run_db(db, crud.set_password_hash, user.id, new_hash)
+    token = auth.create_token(user.email, user.id)
     return {"access_token": token, "token_type": "bearer", "user": user}
 
 
 @app.get("/auth/me", response_model=schemas.UserOut)
-def me(current_user: models.User = Depends(get_current_user)):
+async def me(current_user: auth.CachedUser = Depends(get_current_user)):
     return current_user
 
 
+@app.delete("/auth/me", response_model=schemas.JobOut, status_code=202)
+async def delete_account(
+    response: Response,
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Delete the account and all of its data in the background; poll the returned job."""
+    job = await run_db(db, jobs.enqueue, "delete_account", current_user.id)
+    return accepted(response, job)
+
+
 # ── Expenses ──────────────────────────────────────────────────────────────────
 
 @app.get("/expenses", response_model=List[schemas.ExpenseOut])
-def list_expenses(
+async def list_expenses(
+    request: Request,
+    response: Response,
     category: Optional[str] = None,
     search: Optional[str] = None,
-    month: Optional[int] = None,
-    year: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
-):
-    q = db.query(models.Expense).filter(models.Expense.user_id == current_user.id)
-    if category:
-        q = q.filter(models.Expense.category == category)
-    if search:
-        q = q.filter(models.Expense.note.ilike(f"%{search}%"))
-    if month and year:
-        q = q.filter(
-            models.Expense.date >= datetime(year, month, 1),
-            models.Expense.date < datetime(year, month + 1, 1) if month < 12 else datetime(year + 1, 1, 1),
-        )
-    return q.order_by(models.Expense.date.desc()).all()
+    month: Optional[int] = Query(None, ge=1, le=12),
+    year: Optional[int] = Query(None, ge=1900, le=2100),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: int = Query(crud.DEFAULT_PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db=Depends(get_read_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    try:
+        after = crud.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+    if cached := await not_modified(request, response, db, current_user.id):
+        return cached
+    rows, next_cursor = await run_db(
+        db, crud.list_expenses_page, current_user.id, limit, after,
+        category=category, search=search, month=month, year=year,
+        date_from=date_from, date_to=date_to,
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    # Rows are trusted DB output: serialize them in bulk instead of through response_model
+    # (kept above for the OpenAPI schema). A returned Response does not pick up headers set
+    # on `response`, so they are copied over.
+    return Response(schemas.dump_expenses(rows), media_type="application/json", headers=response.headers)
+
+
+@app.get("/expenses/export")
+async def export_expenses(
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    month: Optional[int] = Query(None, ge=1, le=12),
+    year: Optional[int] = Query(None, ge=1900, le=2100),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Stream every matching expense (no pagination) in the requested format."""
+    try:
+        encoder = exporter.make_encoder(format)
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"{format} export is not available on this server") from None
+    category_id = await run_db(db, crud.category_filter, current_user.id, category)
+    stmt = exporter.export_statement(
+        current_user.id, category_id=category_id, search=search, month=month, year=year,
+        date_from=date_from, date_to=date_to,
+    )
+    return StreamingResponse(
+        exporter.stream(db, stmt, encoder),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f'attachment; filename="expenses.{encoder.extension}"'},
+    )
 
 
 @app.post("/expenses", response_model=schemas.ExpenseOut, status_code=201)
-def create_expense(
+async def create_expense(
     payload: schemas.ExpenseCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
 ):
-    expense = models.Expense(**payload.dict(), user_id=current_user.id)
-    db.add(expense)
-    db.commit()
-    db.refresh(expense)
-    return expense
+    return await run_db(db, crud.create_expense, current_user.id, payload.dict())
+
+
+@app.post("/expenses/import")
+async def import_expenses(
+    response: Response,
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ofx)$"),
+    background: bool = False,
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Bulk-import a CSV or OFX bank statement; returns counts and a per-row error report.
+
+    Valid rows are committed together; invalid rows are skipped and reported. With
+    `background=true` the file is queued instead and the response is a 202 job whose
+    result is the same report.
+    """
+    try:
+        fmt = importer.detect_format(file.filename, format)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from None
+    if background:
+        path = jobs.spool_path()
+        with open(path, "wb") as spooled:
+            await run_in_threadpool(shutil.copyfileobj, file.file, spooled)
+        job = await run_db(
+            db, jobs.enqueue, "import", current_user.id, {"path": path, "format": fmt}, jobs.HOSTNAME,
+        )
+        response.status_code = 202
+        return schemas.JobOut.model_validate(accepted(response, job))
+    parse = importer.iter_ofx if fmt == "ofx" else importer.iter_csv
+    report = importer.ImportReport()
+    chunks = importer.chunks(parse(file.file), report)
+    # Parsing and validation are CPU-bound, so each chunk is produced on the threadpool;
+    # the inserts then share one transaction on the request's session.
+    try:
+        while (rows := await run_in_threadpool(next, chunks, None)) is not None:
+            report.imported += await run_db(db, importer.insert_chunk, current_user.id, rows)
+    except importer.MalformedFile as exc:
+        # Nothing is committed: the rows inserted so far are rolled back with the session.
+        raise HTTPException(status_code=400, detail=str(exc)) from None
+    await run_db(db, crud.commit)
+    return report.as_dict()
+
+
+@app.post("/expenses/batch", response_model=schemas.ExpenseBatchResult)
+async def batch_expenses(
+    payload: schemas.ExpenseBatch,
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Apply up to 500 create/update/delete operations atomically, in order.
+
+    Updates are partial. Each operation gets its own status (201/200/204, or 404 for an
+    id the caller does not own) and the whole batch is committed once.
+    """
+    results = await run_db(db, crud.apply_batch, current_user.id, payload.operations)
+    return {"results": results}
 
 
 @app.put("/expenses/{expense_id}", response_model=schemas.ExpenseOut)
-def update_expense(
+async def update_expense(
     expense_id: int,
     payload: schemas.ExpenseCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
 ):
-    expense = db.query(models.Expense).filter(
-        models.Expense.id == expense_id,
-        models.Expense.user_id == current_user.id
-    ).first()
+    expense = await run_db(db, crud.update_expense, current_user.id, expense_id, payload.dict())
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
-    for k, v in payload.dict().items():
-        setattr(expense, k, v)
-    db.commit()
-    db.refresh(expense)
     return expense
 
 
 @app.delete("/expenses/{expense_id}", status_code=204)
-def delete_expense(
+async def delete_expense(
     expense_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
 ):
-    expense = db.query(models.Expense).filter(
-        models.Expense.id == expense_id,
-        models.Expense.user_id == current_user.id
-    ).first()
-    if not expense:
+    if not await run_db(db, crud.delete_expense, current_user.id, expense_id):
         raise HTTPException(status_code=404, detail="Expense not found")
-    db.delete(expense)
-    db.commit()
+
+
+# ── Categories ────────────────────────────────────────────────────────────────
+
+@app.get("/categories", response_model=List[schemas.CategoryOut])
+async def list_categories(
+    request: Request,
+    response: Response,
+    db=Depends(get_read_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """The default categories, then the caller's custom ones by name."""
+    if cached := await not_modified(request, response, db, current_user.id):
+        return cached
+    return await run_db(db, categories.for_user, current_user.id)
+
+
+@app.post("/categories", response_model=schemas.CategoryOut, status_code=201)
+async def create_category(
+    payload: schemas.CategoryCreate,
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Add a custom category. Creating one that already exists returns it unchanged."""
+    return await run_db(db, crud.create_category, current_user.id, payload.name)
 
 
 # ── Budget ────────────────────────────────────────────────────────────────────
 
 @app.get("/budget", response_model=schemas.BudgetOut)
-def get_budget(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+async def get_budget(
+    request: Request,
+    response: Response,
+    db=Depends(get_read_db),
+    primary=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
 ):
-    budget = db.query(models.Budget).filter(models.Budget.user_id == current_user.id).first()
-    if not budget:
-        budget = models.Budget(user_id=current_user.id, monthly_limit=2000.0)
-        db.add(budget)
-        db.commit()
-        db.refresh(budget)
-    return budget
+    if cached := await not_modified(request, response, db, current_user.id):
+        return cached
+    if budget := await run_db(db, crud.get_budget, current_user.id):
+        return budget
+    # First visit: the default budget is a write.
+    return await run_db(primary, crud.get_or_create_budget, current_user.id)
 
 
 @app.put("/budget", response_model=schemas.BudgetOut)
-def update_budget(
+async def update_budget(
     payload: schemas.BudgetUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
 ):
-    budget = db.query(models.Budget).filter(models.Budget.user_id == current_user.id).first()
-    if not budget:
-        budget = models.Budget(user_id=current_user.id, monthly_limit=payload.monthly_limit)
-        db.add(budget)
-    else:
-        budget.monthly_limit = payload.monthly_limit
-    db.commit()
-    db.refresh(budget)
-    return budget
+    return await run_db(db, crud.set_budget, current_user.id, payload.monthly_limit)
 
 
 # ── Analytics ─────────────────────────────────────────────────────────────────
 
 @app.get("/analytics/summary")
-def analytics_summary(
+async def analytics_summary(
+    request: Request,
+    response: Response,
     month: Optional[int] = None,
     year: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    db=Depends(get_read_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
 ):
     now = datetime.now()
-    m = month or now.month
-    y = year or now.year
-    start = datetime(y, m, 1)
-    end = datetime(y, m + 1, 1) if m < 12 else datetime(y + 1, 1, 1)
+    year, month = year or now.year, month or now.month
+    if cached := await not_modified(request, response, db, current_user.id, year, month):
+        return cached
+    return await run_db(db, crud.month_summary, current_user.id, year, month)
 
-    expenses = db.query(models.Expense).filter(
-        models.Expense.user_id == current_user.id,
-        models.Expense.date >= start,
-        models.Expense.date < end,
-    ).all()
 
-    total = sum(e.amount for e in expenses)
-    by_category = {}
-    for e in expenses:
-        by_category[e.category] = by_category.get(e.category, 0) + e.amount
+@app.get("/analytics/trend")
+async def analytics_trend(
+    request: Request,
+    response: Response,
+    months: int = Query(6, ge=1, le=36),
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    db=Depends(get_read_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Per-month, per-category totals for the `months` months ending at month/year."""
+    now = datetime.now()
+    year, month = year or now.year, month or now.month
+    if cached := await not_modified(request, response, db, current_user.id, year, month):
+        return cached
+    return await run_db(db, crud.month_trend, current_user.id, year, month, months)
+
+
+@app.get("/analytics/forecast")
+async def analytics_forecast(
+    request: Request,
+    response: Response,
+    as_of: Optional[date] = None,
+    db=Depends(get_read_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Projected end-of-month spend per category and the day the budget is (or was) exceeded.
+
+    `as_of` (default today) is the last day counted as actual spend.
+    """
+    as_of = as_of or date.today()
+    if cached := await not_modified(request, response, db, current_user.id, as_of):
+        return cached
+    return await run_db(db, forecast.forecast_user, current_user.id, as_of)
+
+
+# ── Dashboard ─────────────────────────────────────────────────────────────────
+
+@app.get("/dashboard", response_model=schemas.DashboardOut)
+async def get_dashboard(
+    request: Request,
+    response: Response,
+    month: Optional[int] = Query(None, ge=1, le=12),
+    year: Optional[int] = Query(None, ge=1900, le=2100),
+    recent: int = Query(5, ge=1, le=50),
+    db=Depends(get_read_db),
+    primary=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Everything the dashboard shows first, in one request: the user, their budget, the
+    month's budget status with per-category totals, and its `recent` newest expenses."""
+    now = datetime.now()
+    year, month = year or now.year, month or now.month
+    if cached := await not_modified(request, response, db, current_user.id, year, month):
+        return cached
+    # One trip to the threadpool for every query; statements on a session run in turn anyway.
+    data = await run_db(db, crud.dashboard, current_user.id, year, month, recent)
+    if data["budget"] is None:
+        # First visit, as with GET /budget: the default budget is a write.
+        data["budget"] = await run_db(primary, crud.get_or_create_budget, current_user.id)
+    return {"user": current_user, **data}
+
+
+# ── Streams ───────────────────────────────────────────────────────────────────
+
+# Idle streams send a comment this often so proxies do not time them out.
+STREAM_HEARTBEAT_SECONDS = 15.0
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def budget_events(db, user_id: int):
+    """Server-sent events: the budget status now, then again after each change to it.
+
+    Like the export streams, this reuses the request's already-closed session. Each read is
+    committed so the stream holds no connection while idle.
+    """
+    subscription = events.broker.subscribe(user_id)
+    try:
+        yield "retry: 5000\n\n"
+        last = None
+        while True:
+            now = datetime.now()
+            status = await run_db(db, crud.budget_status, user_id, now.year, now.month)
+            await run_db(db, crud.commit)
+            if status != last:
+                yield _sse("budget", status)
+                last = status
+            # Several writes while the status was being read wake the stream only once.
+            while not await subscription.wait(STREAM_HEARTBEAT_SECONDS):
+                yield ": keep-alive\n\n"
+    finally:
+        events.broker.unsubscribe(subscription)
+        await run_db(db, crud.close)
+
+
+@app.get("/stream/budget")
+async def stream_budget(
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Live budget status for the current month as `text/event-stream`.
+
+    Each `budget` event carries the analytics summary plus `remaining`, `percent_used` and
+    `over_limit`, and is sent on connect and whenever the user's expenses or budget change.
+    Reads go to the primary: a change is announced as soon as it commits.
+    """
+    return StreamingResponse(
+        budget_events(db, current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    budget = db.query(models.Budget).filter(models.Budget.user_id == current_user.id).first()
-    monthly_limit = budget.monthly_limit if budget else 2000.0
 
+# ── Jobs ──────────────────────────────────────────────────────────────────────
+
+def accepted(response: Response, job):
+    """Start `job` promptly and point the client at its status URL."""
+    jobs.runner.notify()
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return job
+
+
+@app.post("/jobs", response_model=schemas.JobOut, status_code=202)
+async def create_job(
+    payload: schemas.JobCreate,
+    response: Response,
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    job = await run_db(db, jobs.enqueue, payload.kind, current_user.id)
+    return accepted(response, job)
+
+
+@app.get("/jobs/{job_id}", response_model=schemas.JobOut)
+async def get_job(
+    job_id: str,
+    db=Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """Status and progress of one of the caller's jobs."""
+    job = await run_db(db, jobs.get_job, current_user.id, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# ── Operations ────────────────────────────────────────────────────────────────
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving. Never touches the database."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the database answers and the pool has been warmed."""
+    try:
+        if app.state.warm:
+            await asyncio.wait_for(ping(), PROBE_TIMEOUT)
+        else:
+            await asyncio.wait_for(warm_pool(), PROBE_TIMEOUT)
+            app.state.warm = True
+    except Exception as exc:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": type(exc).__name__})
+    return {"status": "ready"}
+
+
+def require_ops_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))):
+    """Guard for the operator endpoints, which describe the process's internals."""
+    if not OPS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), OPS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid operator token")
+
+
+@app.get("/stats", dependencies=[Depends(require_ops_token)])
+async def stats():
+    """Live connection pool occupancy and checkout wait times, token and category cache sizes,
+    and open budget streams."""
     return {
-        "total": total,
-        "monthly_limit": monthly_limit,
-        "by_category": by_category,
-        "expense_count": len(expenses),
-        "month": m,
-        "year": y,
+        "db_pool": all_pool_stats(),
+        "token_cache": auth.token_cache.stats(),
+        "category_cache": categories.cache.stats(),
+        "budget_streams": events.broker.stats(),
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_ops_token)])
+async def prometheus_metrics():
+    """Request latency, status counts and per-request SQL stats in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Development server, reloading on code changes. Production runs gunicorn (gunicorn.conf.py).
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")), reload=True)
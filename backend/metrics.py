@@ -0,0 +1,253 @@
+"""In-process request and SQL metrics, rendered in the Prometheus text format at /metrics.
+
+`MetricsMiddleware` times every request and labels it by route template (``/expenses/{expense_id}``,
+never the raw path, so label cardinality stays bounded). SQLAlchemy cursor events attribute
+each query to the request that ran it through a context variable; the variable is copied
+into threadpool workers and ``run_sync`` greenlets, so both DB modes are covered.
+
+Metrics are per worker process. Scrape every worker, or aggregate in Prometheus.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import config  # noqa: F401  (loads .env before the settings below are read)
+
+logger = logging.getLogger("smartexpense.metrics")
+
+# Requests running more queries than this, or single queries / whole requests slower than
+# these thresholds, are logged as warnings.
+QUERY_COUNT_WARN = int(os.getenv("QUERY_COUNT_WARN", "20"))
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.2"))
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+# ── Metric types ──────────────────────────────────────────────────────────────
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        names = self.labels + ("le",)
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(names, label_values + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+def _samples(name: str, kind: str, help: str, samples):
+    """Render a metric whose (label_dict, value) samples are read at scrape time."""
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} {kind}"
+    for labels, value in samples:
+        yield f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}"
+
+
+# ── Registry ──────────────────────────────────────────────────────────────────
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("method", "route"),
+)
+REQUESTS = Counter(
+    "http_requests_total", "Requests by route and status code.", ("method", "route", "status"),
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per request.", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds", "Time spent in SQL per request.", ("method", "route"),
+)
+QUERY_LATENCY = Histogram("db_query_duration_seconds", "Latency of individual SQL statements.")
+
+METRICS = (REQUEST_LATENCY, REQUESTS, REQUEST_QUERIES, REQUEST_DB_TIME, QUERY_LATENCY)
+
+
+def render() -> str:
+    import auth
+    from database import all_pool_stats
+
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    pools = all_pool_stats()
+    for field, name, kind, help in (
+        ("checked_out", "db_pool_checked_out", "gauge", "Connections currently checked out of the pool."),
+        ("overflow", "db_pool_overflow", "gauge", "Connections open beyond pool_size."),
+        ("checkouts", "db_pool_checkouts_total", "counter", "Connections handed out by the pool."),
+        ("timeouts", "db_pool_timeouts_total", "counter", "Checkouts that gave up after pool_timeout."),
+        ("wait_seconds_total", "db_pool_wait_seconds_total", "counter", "Time spent in pool checkouts."),
+    ):
+        lines.extend(_samples(
+            name, kind, help,
+            [({"engine": engine}, stats[field]) for engine, stats in pools.items() if field in stats],
+        ))
+
+    cache = auth.token_cache.stats()
+    lines.extend(_samples("token_cache_size", "gauge", "Entries in the token cache.", [({}, cache["size"])]))
+    for field in ("hits", "misses", "evictions"):
+        lines.extend(_samples(f"token_cache_{field}_total", "counter", f"Token cache {field}.", [({}, cache[field])]))
+    return "\n".join(lines) + "\n"
+
+
+# ── Per-request SQL accounting ────────────────────────────────────────────────
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_stats", default=None,
+)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    QUERY_LATENCY.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        logger.warning("Slow query (%.3fs): %s", elapsed, " ".join(statement.split())[:500])
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time.
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+# ── Middleware ────────────────────────────────────────────────────────────────
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed bodies are timed until their last chunk is sent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        streaming = False
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = (b"content-type", b"text/event-stream") in (
+                    (k.lower(), v.split(b";")[0]) for k, v in message.get("headers", ())
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            route = scope.get("route")
+            # Unmatched paths (404s, scanners) share one label instead of one series each.
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            REQUEST_LATENCY.observe(elapsed, method, path)
+            REQUESTS.inc(method, path, str(status))
+            REQUEST_QUERIES.observe(stats.queries, method, path)
+            REQUEST_DB_TIME.observe(stats.db_seconds, method, path)
+            # Event streams stay open, re-querying, for as long as the client listens.
+            if not streaming and (stats.queries > QUERY_COUNT_WARN or elapsed >= SLOW_REQUEST_SECONDS):
+                logger.warning(
+                    "%s %s took %.3fs with %d queries (%.3fs in SQL)",
+                    method, path, elapsed, stats.queries, stats.db_seconds,
+                )
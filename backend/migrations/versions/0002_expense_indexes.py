@@ -0,0 +1,50 @@
+"""composite indexes for the expense hot paths
+
+Every expense read filters on ``user_id`` plus a ``date`` range, so:
+
+* ``ix_expenses_user_date_id`` serves the newest-first keyset pagination in ``GET /expenses``
+  and, through its INCLUDE columns, lets the monthly analytics aggregate run as an
+  index-only scan on Postgres.
+* ``ix_expenses_user_category_date`` serves category-filtered listings.
+
+On Postgres the indexes are built CONCURRENTLY so the upgrade does not block writes.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-06-01 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_expenses_user_date_id",
+            "expenses",
+            ["user_id", sa.text("date DESC"), "id"],
+            postgresql_include=["category", "amount"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_expenses_user_category_date",
+            "expenses",
+            ["user_id", "category", "date"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_expenses_user_category_date", "expenses", postgresql_concurrently=True)
+        op.drop_index("ix_expenses_user_date_id", "expenses", postgresql_concurrently=True)
@@ -0,0 +1,58 @@
+"""monthly_category_totals rollup
+
+Creates the rollup read by the analytics endpoints and backfills it from ``expenses``.
+From here on the expense write endpoints keep it current (see rollup.py).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-06-08 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    rollup = op.create_table(
+        "monthly_category_totals",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("month", sa.Integer(), nullable=False),
+        sa.Column("category", sa.String(), nullable=False),
+        sa.Column("total", sa.Float(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "year", "month", "category"),
+    )
+
+    expenses = sa.table(
+        "expenses",
+        sa.column("user_id", sa.Integer),
+        sa.column("category", sa.String),
+        sa.column("amount", sa.Float),
+        sa.column("date", sa.DateTime),
+    )
+    year = sa.cast(sa.extract("year", expenses.c.date), sa.Integer)
+    month = sa.cast(sa.extract("month", expenses.c.date), sa.Integer)
+    op.execute(
+        rollup.insert().from_select(
+            ["user_id", "year", "month", "category", "total", "count"],
+            sa.select(
+                expenses.c.user_id, year, month, expenses.c.category,
+                sa.func.sum(expenses.c.amount), sa.func.count(),
+            ).group_by(expenses.c.user_id, year, month, expenses.c.category),
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("monthly_category_totals")
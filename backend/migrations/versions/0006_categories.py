@@ -0,0 +1,162 @@
+"""categories dimension table; expenses and the rollup reference it by id
+
+Creates ``categories`` with the default set (``user_id`` NULL) and one custom row per other
+(user, name) pair found in ``expenses``. ``expenses.category`` is then replaced by
+``category_id``, and the two indexes that covered the text column are rebuilt on the id.
+
+``monthly_category_totals`` is derived data, so it is dropped and re-aggregated by id
+rather than rewritten in place.
+
+The backfill rewrites every expense row in one transaction; on a large database run it in
+a quiet period.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-06-29 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Keep in sync with categories.DEFAULTS.
+DEFAULTS = (
+    "Food & Drink", "Transport", "Housing", "Entertainment",
+    "Health", "Shopping", "Utilities", "Other",
+)
+
+
+def _expenses():
+    return sa.table(
+        "expenses",
+        sa.column("id", sa.Integer),
+        sa.column("user_id", sa.Integer),
+        sa.column("amount", sa.Float),
+        sa.column("date", sa.DateTime),
+        sa.column("category", sa.String),
+        sa.column("category_id", sa.Integer),
+    )
+
+
+def _create_rollup(category_column: sa.Column):
+    return op.create_table(
+        "monthly_category_totals",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("month", sa.Integer(), nullable=False),
+        category_column,
+        sa.Column("total", sa.Float(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "year", "month", category_column.name),
+    )
+
+
+def _fill_rollup(rollup, expenses, category):
+    year = sa.cast(sa.extract("year", expenses.c.date), sa.Integer)
+    month = sa.cast(sa.extract("month", expenses.c.date), sa.Integer)
+    op.execute(
+        rollup.insert().from_select(
+            ["user_id", "year", "month", category.name, "total", "count"],
+            sa.select(
+                expenses.c.user_id, year, month, category,
+                sa.func.sum(expenses.c.amount), sa.func.count(),
+            ).group_by(expenses.c.user_id, year, month, category),
+        )
+    )
+
+
+def _expense_indexes(category_column: str):
+    op.create_index(
+        "ix_expenses_user_date_id",
+        "expenses",
+        ["user_id", sa.text("date DESC"), "id"],
+        postgresql_include=[category_column, "amount"],
+    )
+    op.create_index("ix_expenses_user_category_date", "expenses", ["user_id", category_column, "date"])
+
+
+def upgrade() -> None:
+    categories = op.create_table(
+        "categories",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+    )
+    op.create_index("uq_categories_user_name", "categories", ["user_id", "name"], unique=True)
+    op.create_index(
+        "uq_categories_default_name", "categories", ["name"], unique=True,
+        postgresql_where=sa.text("user_id IS NULL"), sqlite_where=sa.text("user_id IS NULL"),
+    )
+    op.bulk_insert(categories, [{"name": name} for name in DEFAULTS])
+
+    expenses = _expenses()
+    op.execute(
+        categories.insert().from_select(
+            ["user_id", "name"],
+            sa.select(expenses.c.user_id, expenses.c.category)
+            .where(expenses.c.category.not_in(DEFAULTS))
+            .distinct(),
+        )
+    )
+
+    op.add_column("expenses", sa.Column("category_id", sa.Integer(), nullable=True))
+    default_id = (
+        sa.select(categories.c.id)
+        .where(categories.c.user_id.is_(None), categories.c.name == expenses.c.category)
+        .scalar_subquery()
+    )
+    custom_id = (
+        sa.select(categories.c.id)
+        .where(categories.c.user_id == expenses.c.user_id, categories.c.name == expenses.c.category)
+        .scalar_subquery()
+    )
+    op.execute(expenses.update().values(category_id=sa.func.coalesce(default_id, custom_id)))
+
+    op.drop_index("ix_expenses_user_category_date", table_name="expenses")
+    op.drop_index("ix_expenses_user_date_id", table_name="expenses")
+    with op.batch_alter_table("expenses") as batch:
+        batch.alter_column("category_id", existing_type=sa.Integer(), nullable=False)
+        batch.create_foreign_key("fk_expenses_category_id", "categories", ["category_id"], ["id"])
+        batch.drop_column("category")
+    _expense_indexes("category_id")
+
+    op.drop_table("monthly_category_totals")
+    rollup = _create_rollup(sa.Column("category_id", sa.Integer(), sa.ForeignKey("categories.id"), nullable=False))
+    _fill_rollup(rollup, expenses, expenses.c.category_id)
+
+
+def downgrade() -> None:
+    categories = sa.table(
+        "categories", sa.column("id", sa.Integer), sa.column("name", sa.String),
+    )
+    expenses = _expenses()
+
+    op.add_column("expenses", sa.Column("category", sa.String(), nullable=True))
+    op.execute(expenses.update().values(
+        category=sa.select(categories.c.name).where(categories.c.id == expenses.c.category_id).scalar_subquery()
+    ))
+    op.drop_index("ix_expenses_user_category_date", table_name="expenses")
+    op.drop_index("ix_expenses_user_date_id", table_name="expenses")
+    with op.batch_alter_table("expenses") as batch:
+        batch.alter_column("category", existing_type=sa.String(), nullable=False)
+        batch.drop_constraint("fk_expenses_category_id", type_="foreignkey")
+        batch.drop_column("category_id")
+    _expense_indexes("category")
+
+    op.drop_table("monthly_category_totals")
+    rollup = _create_rollup(sa.Column("category", sa.String(), nullable=False))
+    _fill_rollup(rollup, expenses, expenses.c.category)
+
+    op.drop_index("uq_categories_default_name", table_name="categories")
+    op.drop_index("uq_categories_user_name", table_name="categories")
+    op.drop_table("categories")
@@ -0,0 +1,121 @@
+"""partition expenses by month on Postgres; expense_archives
+
+On Postgres ``expenses`` is rebuilt as a table partitioned by RANGE (date), with one
+partition per month from the oldest expense through PARTITION_AHEAD_MONTHS after the
+current month, plus a default partition. The primary key becomes (id, date), since a
+unique constraint on a partitioned table must include the partition key; ids still come
+from the existing sequence. Further months are created by ``partitions.py ensure``.
+
+Every row is copied into the new table in one transaction; on a large database run it in
+a maintenance window. Other databases only get the ``expense_archives`` table.
+
+Downgrading folds the partitions back into one table. Restore archived months first
+(``partitions.py restore``); archive tables left behind are not merged back.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-07-06 00:00:00
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Keep in sync with partitions.PARTITION_AHEAD_MONTHS' default and partitions.partition_name.
+AHEAD_MONTHS = 3
+COLUMNS = "id, user_id, amount, note, date, created_at, category_id"
+
+
+def _add_months(d: date, months: int) -> date:
+    year, month = divmod(d.year * 12 + d.month - 1 + months, 12)
+    return date(year, month + 1, 1)
+
+
+def _create_expenses(sequence: str, primary_key: str, partition_by: str = ""):
+    op.execute(f"""
+        CREATE TABLE expenses (
+            id integer NOT NULL DEFAULT nextval('{sequence}'::regclass),
+            user_id integer NOT NULL REFERENCES users (id),
+            amount double precision NOT NULL,
+            note text,
+            date timestamp without time zone NOT NULL,
+            created_at timestamp without time zone,
+            category_id integer NOT NULL CONSTRAINT fk_expenses_category_id REFERENCES categories (id),
+            CONSTRAINT expenses_pkey PRIMARY KEY ({primary_key})
+        ) {partition_by}
+    """)
+
+
+def _swap_out(old_name: str) -> str:
+    """Rename expenses (and its primary key) to `old_name`, detach its id sequence and drop
+    its secondary indexes, whose names the new table reuses. Returns the sequence name."""
+    sequence = op.get_bind().scalar(sa.text("SELECT pg_get_serial_sequence('expenses', 'id')"))
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    for index in ("ix_expenses_user_category_date", "ix_expenses_user_date_id", "ix_expenses_id"):
+        op.drop_index(index, table_name="expenses")
+    op.execute(f"ALTER TABLE expenses RENAME TO {old_name}")
+    op.execute(f"ALTER INDEX expenses_pkey RENAME TO {old_name}_pkey")
+    return sequence
+
+
+def _swap_in(old_name: str, sequence: str):
+    op.execute(f"INSERT INTO expenses ({COLUMNS}) SELECT {COLUMNS} FROM {old_name}")
+    op.execute(f"DROP TABLE {old_name}")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY expenses.id")
+    op.create_index("ix_expenses_id", "expenses", ["id"])
+    op.create_index(
+        "ix_expenses_user_date_id",
+        "expenses",
+        ["user_id", sa.text("date DESC"), "id"],
+        postgresql_include=["category_id", "amount"],
+    )
+    op.create_index("ix_expenses_user_category_date", "expenses", ["user_id", "category_id", "date"])
+    op.execute("ANALYZE expenses")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "expense_archives",
+        sa.Column("month", sa.Date(), primary_key=True),
+        sa.Column("table_name", sa.String(), nullable=True),
+        sa.Column("file", sa.String(), nullable=True),
+        sa.Column("rows", sa.Integer(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+    )
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    sequence = _swap_out("expenses_unpartitioned")
+    _create_expenses(sequence, "id, date", "PARTITION BY RANGE (date)")
+
+    oldest, newest = bind.execute(sa.text("SELECT min(date), max(date) FROM expenses_unpartitioned")).one()
+    today = date.today()
+    month = date((oldest or today).year, (oldest or today).month, 1)
+    last = _add_months(max(newest.date() if newest else today, today), AHEAD_MONTHS)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE expenses_p{month:%Y_%m} PARTITION OF expenses "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE expenses_default PARTITION OF expenses DEFAULT")
+
+    _swap_in("expenses_unpartitioned", sequence)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        sequence = _swap_out("expenses_partitioned")
+        _create_expenses(sequence, "id")
+        _swap_in("expenses_partitioned", sequence)  # dropping the parent drops its partitions
+    op.drop_table("expense_archives")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, JSON, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -12,18 +12,28 @@ class User(Base):
     name = Column(String, nullable=False)
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Bumped by every expense/budget write; read endpoints derive their ETag from it.
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     expenses = relationship("Expense", back_populates="user", cascade="all, delete-orphan")
     budget = relationship("Budget", back_populates="user", uselist=False, cascade="all, delete-orphan")
+    monthly_totals = relationship(
+        "MonthlyCategoryTotal", cascade="all, delete-orphan", passive_deletes=True,
+    )
 
 
 class Expense(Base):
+    """On Postgres the table is range-partitioned by month on `date` (migration 0007,
+    partitions.py), and its real primary key is (id, date). The ORM keeps `id` as the
+    identity: ids still come from one sequence, so they stay unique.
+    """
+
     __tablename__ = "expenses"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     amount = Column(Float, nullable=False)
-    category = Column(String, nullable=False)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
     note = Column(Text, default="")
     date = Column(DateTime, nullable=False, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -31,6 +41,36 @@ class Expense(Base):
     user = relationship("User", back_populates="expenses")
 
 
+# Keep in sync with migrations/versions/0002_expense_indexes.py and 0006_categories.py
+Index(
+    "ix_expenses_user_date_id",
+    Expense.user_id, Expense.date.desc(), Expense.id,
+    postgresql_include=["category_id", "amount"],
+)
+Index("ix_expenses_user_category_date", Expense.user_id, Expense.category_id, Expense.date)
+
+
+class Category(Base):
+    """A system default category (user_id NULL) or one user's custom category.
+
+    Never renamed, so categories.py can cache id <-> name for the life of the process.
+    """
+
+    __tablename__ = "categories"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+    name = Column(String, nullable=False)
+
+
+Index("uq_categories_user_name", Category.user_id, Category.name, unique=True)
+# NULLs are distinct in a unique index, so the defaults need their own.
+Index(
+    "uq_categories_default_name", Category.name, unique=True,
+    postgresql_where=Category.user_id.is_(None), sqlite_where=Category.user_id.is_(None),
+)
+
+
 class Budget(Base):
     __tablename__ = "budgets"
 
@@ -40,3 +80,60 @@ class Budget(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user = relationship("User", back_populates="budget")
+
+
+class MonthlyCategoryTotal(Base):
+    """Per-user monthly spend by category, maintained by rollup.py on every expense write."""
+
+    __tablename__ = "monthly_category_totals"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), primary_key=True)
+    total = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class Job(Base):
+    """A unit of background work run by jobs.py; rows double as the queue and the status record."""
+
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True)
+    # No foreign key: an account-deletion job must outlive the user it deletes.
+    user_id = Column(Integer, nullable=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    params = Column(JSON, nullable=False, default=dict)
+    # Jobs whose input only exists on one host (spooled uploads) may only run there.
+    affinity = Column(String, nullable=True)
+    done = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    locked_by = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+Index("ix_jobs_status_created", Job.status, Job.created_at)
+Index("ix_jobs_user_created", Job.user_id, Job.created_at)
+
+
+class ExpenseArchive(Base):
+    """A month of expenses detached from the partitioned table by partitions.py.
+
+    The month's rows live on in `table_name` until it is exported to `file` and dropped.
+    Its rollup buckets are kept, and rollup rebuilds leave archived months alone.
+    """
+
+    __tablename__ = "expense_archives"
+
+    month = Column(Date, primary_key=True)  # first day of the month
+    table_name = Column(String, nullable=True)
+    file = Column(String, nullable=True)
+    rows = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,330 @@
+"""Monthly range partitions of ``expenses`` on Postgres, and archival of cold months.
+
+Migration 0007 makes ``expenses`` a table partitioned by RANGE (date): one partition per
+calendar month (``expenses_p2024_06``) plus ``expenses_default`` for dates no partition
+covers. Date-bounded queries (month filters, keyset pages after the first, exports, the
+forecast window) only scan the partitions they need, and vacuum and index maintenance
+work one month at a time, so months that stopped changing stop costing anything.
+
+``ensure`` creates the partitions for the current month and the PARTITION_AHEAD_MONTHS
+after it, and moves rows out of the default partition into partitions of their own:
+imported history and backdated entries older than the first partition land there. The
+API runs it at startup; run it from a daily cron as well so long-lived processes never
+fall back to the default partition.
+
+``archive`` detaches every month before a given one into a standalone
+``expenses_archive_YYYY_MM`` table, recorded in ``expense_archives``. With an export
+directory the table is also written out as gzipped CSV and dropped. Archived months keep
+their rollup totals, so analytics still include them; listings, exports and the forecast
+no longer do. ``restore`` attaches an archived table again.
+
+    python partitions.py ensure [--ahead 3]
+    python partitions.py list
+    python partitions.py archive --before 2023-01 [--export-dir DIR]
+    python partitions.py restore 2022-12
+
+On other databases ``expenses`` is a plain table and ``ensure`` does nothing.
+"""
+import argparse
+import gzip
+import logging
+import os
+import re
+import sys
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+import config  # noqa: F401  (loads .env before the settings below are read)
+import models
+
+logger = logging.getLogger("smartexpense.partitions")
+
+PARTITION_AHEAD_MONTHS = int(os.getenv("PARTITION_AHEAD_MONTHS", "3"))
+
+TABLE = "expenses"
+
+Archive = models.ExpenseArchive
+
+
+# ── Months ────────────────────────────────────────────────────────────────────
+
+def month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, months: int) -> date:
+    """First day of the month `months` after `d`'s (negative goes back)."""
+    year, month = divmod(d.year * 12 + d.month - 1 + months, 12)
+    return date(year, month + 1, 1)
+
+
+def partition_name(month: date, table: str = TABLE) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def archive_name(month: date, table: str = TABLE) -> str:
+    return f"{table}_archive_{month:%Y_%m}"
+
+
+def parse_month(name: str, table: str = TABLE) -> Optional[date]:
+    """The month of a partition named by `partition_name`, or None for any other table."""
+    match = re.fullmatch(rf"{re.escape(table)}_p(\d{{4}})_(\d{{2}})", name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def _bounds(month: date) -> str:
+    # Partition bounds are DDL and cannot be bound parameters; both ends are formatted dates.
+    return f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+
+
+# ── Partitions ────────────────────────────────────────────────────────────────
+
+def enabled(db: Session, table: str = TABLE) -> bool:
+    """True when `table` is partitioned: on Postgres, after migration 0007."""
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return bool(db.scalar(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"),
+        {"t": table},
+    ))
+
+
+def _lock(db: Session, table: str):
+    # Serializes partition DDL across API processes starting at once; released at commit.
+    db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k))"), {"k": f"partitions:{table}"})
+
+
+def partitions(db: Session, table: str = TABLE) -> list:
+    """(name, bound expression, estimated rows) for each of `table`'s partitions, by name."""
+    return db.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:t) ORDER BY c.relname"
+    ), {"t": table}).all()
+
+
+def _has_default(db: Session, table: str) -> bool:
+    return bool(db.scalar(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": f"{table}_default"}))
+
+
+def _move_from_default(db: Session, into: str, month: date, table: str) -> int:
+    """Move the rows for `month` out of `table`'s default partition into `into`; the count."""
+    return db.execute(text(
+        f"WITH moved AS (DELETE FROM {table}_default WHERE date >= :lo AND date < :hi RETURNING *) "
+        f"INSERT INTO {into} SELECT * FROM moved"
+    ), {"lo": month, "hi": add_months(month, 1)}).rowcount
+
+
+def create_partition(db: Session, month: date, table: str = TABLE) -> str:
+    """Create `table`'s partition for `month` and return its name. Does not commit.
+
+    Postgres refuses to add a partition while the default partition holds rows in its
+    range, so any such rows are moved into the new table before it is attached.
+    """
+    name = partition_name(month, table)
+    stray = _has_default(db, table) and db.scalar(
+        text(f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE date >= :lo AND date < :hi)"),
+        {"lo": month, "hi": add_months(month, 1)},
+    )
+    if not stray:
+        db.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {_bounds(month)}"))
+        return name
+    db.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+    _move_from_default(db, name, month, table)
+    # Attaching builds the parent's indexes and foreign keys on the new partition.
+    db.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} {_bounds(month)}"))
+    return name
+
+
+def stray_months(db: Session, table: str = TABLE) -> list:
+    """Months with rows in `table`'s default partition, oldest first, archived months aside.
+
+    Rows dated before the first partition land there: imported history, backdated entries.
+    Rows for an archived month stay there until ``restore`` moves them into its table.
+    """
+    if not _has_default(db, table):
+        return []
+    archived = set(db.scalars(select(Archive.month)))
+    months = db.scalars(text(f"SELECT DISTINCT date_trunc('month', date)::date FROM {table}_default ORDER BY 1"))
+    return [month for month in months if month not in archived]
+
+
+def ensure_partitions(db: Session, ahead: int = PARTITION_AHEAD_MONTHS, today: Optional[date] = None,
+                      table: str = TABLE) -> list:
+    """Create any missing partitions from this month through `ahead` months on, and for every
+    month with rows in the default partition (see `stray_months`). Does not commit.
+
+    Returns the names created; an empty list when `table` is not partitioned.
+    """
+    if not enabled(db, table):
+        return []
+    _lock(db, table)
+    existing = {name for name, _, _ in partitions(db, table)}
+    first = month_start(today or date.today())
+    months = set(stray_months(db, table)) | {add_months(first, i) for i in range(ahead + 1)}
+    created = []
+    for month in sorted(months):
+        if partition_name(month, table) not in existing:
+            created.append(create_partition(db, month, table))
+    return created
+
+
+def ensure_on_startup():
+    """ensure_partitions on a session of its own; for the API's lifespan."""
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        created = ensure_partitions(db)
+        db.commit()
+    if created:
+        logger.info("Created expense partitions: %s", ", ".join(created))
+
+
+# ── Archives ──────────────────────────────────────────────────────────────────
+
+def horizon(db: Session) -> Optional[date]:
+    """First month after the newest archived one, or None when nothing is archived.
+
+    Expenses before it are not in ``expenses`` any more, so the rollup keeps its buckets
+    for those months as they were.
+    """
+    newest = db.scalar(select(func.max(Archive.month)))
+    return add_months(newest, 1) if newest else None
+
+
+def export(db: Session, table_name: str, export_dir: str) -> str:
+    """Write `table_name` to ``<export_dir>/<table_name>.csv.gz`` and return the path."""
+    path = os.path.join(export_dir, f"{table_name}.csv.gz")
+    cursor = db.connection().connection.cursor()
+    with gzip.open(path, "wb") as f:
+        cursor.copy_expert(f"COPY {table_name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    return path
+
+
+def archive(db: Session, before: date, export_dir: Optional[str] = None) -> list:
+    """Detach every monthly partition of a month before `before`'s; see the module docstring.
+
+    Commits after each month, so the parent table is only locked for one detach at a time.
+    Returns the ExpenseArchive rows written, oldest first.
+    """
+    cutoff = month_start(before)
+    if cutoff > month_start(date.today()):
+        raise ValueError("Only months before the current one can be archived")
+    if not enabled(db):
+        return []
+    # Months still in the default partition get partitions first, so they are archived too.
+    ensure_partitions(db)
+    db.commit()
+    archived = []
+    for name, _, _ in partitions(db):
+        month = parse_month(name)
+        if month is None or month >= cutoff:
+            continue
+        _lock(db, TABLE)
+        table_name = archive_name(month)
+        db.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+        db.execute(text(f"ALTER TABLE {name} RENAME TO {table_name}"))
+        # Standalone now: its foreign keys would only block deleting users and categories.
+        # Account deletion purges archived rows itself (purge_user).
+        foreign_keys = db.scalars(
+            text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype = 'f'"),
+            {"t": table_name},
+        ).all()
+        for constraint in foreign_keys:
+            db.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT "{constraint}"'))
+        record = Archive(
+            month=month, table_name=table_name, rows=db.scalar(text(f"SELECT count(*) FROM {table_name}")),
+            archived_at=datetime.utcnow(),
+        )
+        if export_dir:
+            record.file = export(db, table_name, export_dir)
+            db.execute(text(f"DROP TABLE {table_name}"))
+            record.table_name = None
+        db.add(record)
+        db.commit()
+        archived.append(record)
+    return archived
+
+
+def restore(db: Session, month: date, table: str = TABLE):
+    """Attach an archived month's table again and forget the archive. Commits.
+
+    Rows dated in the month since it was archived sit in the default partition, which
+    would block the attach; they are moved into the archived table first.
+    Exported-and-dropped months must be loaded back from their file by hand first.
+    """
+    month = month_start(month)
+    record = db.get(Archive, month)
+    if record is None or record.table_name is None:
+        raise ValueError(f"No archived table for {month:%Y-%m}")
+    _lock(db, table)
+    name = partition_name(month, table)
+    if _has_default(db, table):
+        _move_from_default(db, record.table_name, month, table)
+    db.execute(text(f"ALTER TABLE {record.table_name} RENAME TO {name}"))
+    # Re-creates the parent's indexes and foreign keys, validating every row against them.
+    db.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} {_bounds(month)}"))
+    db.delete(record)
+    db.commit()
+
+
+def purge_user(db: Session, user_id: int) -> int:
+    """Delete `user_id`'s rows from archived tables still in the database. Does not commit.
+
+    Rows already exported to files are out of reach; see README.
+    """
+    deleted = 0
+    for table_name in db.scalars(select(Archive.table_name).where(Archive.table_name.is_not(None))):
+        deleted += db.execute(
+            text(f"DELETE FROM {table_name} WHERE user_id = :uid"), {"uid": user_id},
+        ).rowcount
+    return deleted
+
+
+def _month(value: str) -> date:
+    return month_start(date.fromisoformat(value if len(value) > 7 else f"{value}-01"))
+
+
+def main(argv=None) -> int:
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    ensure = sub.add_parser("ensure")
+    ensure.add_argument("--ahead", type=int, default=PARTITION_AHEAD_MONTHS)
+    sub.add_parser("list")
+    archive_cmd = sub.add_parser("archive")
+    archive_cmd.add_argument("--before", type=_month, required=True, help="first month to keep, YYYY-MM")
+    archive_cmd.add_argument("--export-dir", help="write each month to gzipped CSV here and drop its table")
+    restore_cmd = sub.add_parser("restore")
+    restore_cmd.add_argument("month", type=_month, help="YYYY-MM")
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        if not enabled(db):
+            print(f"{TABLE} is not partitioned (Postgres only, after migration 0007)")
+            return 1
+        if args.command == "ensure":
+            created = ensure_partitions(db, args.ahead)
+            db.commit()
+            print(f"created {len(created)} partition(s)" + (f": {', '.join(created)}" if created else ""))
+        elif args.command == "list":
+            for name, bound, rows in partitions(db):
+                print(f"{name:24} {bound:60} ~{max(rows, 0)} rows")
+            for record in db.scalars(select(Archive).order_by(Archive.month)):
+                where = record.table_name or record.file
+                print(f"archived {record.month:%Y-%m}: {record.rows} rows in {where}")
+        elif args.command == "archive":
+            for record in archive(db, args.before, args.export_dir):
+                print(f"archived {record.month:%Y-%m}: {record.rows} rows in {record.table_name or record.file}")
+        else:
+            restore(db, args.month)
+            print(f"restored {args.month:%Y-%m}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""Incrementally maintained monthly_category_totals rollup.
+
+Every expense write adjusts the (user, year, month, category) bucket it touches inside the
+caller's transaction, so analytics read O(categories) rows instead of scanning expenses.
+``rebuild`` and ``verify`` recompute the buckets from ``expenses`` for repairs and audits.
+Months archived out of ``expenses`` (partitions.py) are left as they are:
+
+    python rollup.py verify [--user-id N]
+    python rollup.py rebuild [--user-id N]
+"""
+import argparse
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import extract, func, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+import partitions
+
+# Rollup totals are float sums accumulated over many writes; anything under a cent is noise.
+DRIFT_TOLERANCE = 0.005
+
+_DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+Rollup = models.MonthlyCategoryTotal
+
+
+def apply(db: Session, user_id: int, date: datetime, category_id: int, amount: float, count: int):
+    """Add `amount` and `count` (either may be negative) to the bucket for `date`/`category_id`."""
+    insert = _DIALECT_INSERTS[db.get_bind().dialect.name]
+    stmt = insert(Rollup).values(
+        user_id=user_id, year=date.year, month=date.month, category_id=category_id,
+        total=amount, count=count,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Rollup.user_id, Rollup.year, Rollup.month, Rollup.category_id],
+        set_={
+            "total": Rollup.total + stmt.excluded.total,
+            "count": Rollup.count + stmt.excluded.count,
+        },
+    )
+    db.execute(stmt)
+    if count < 0:
+        db.query(Rollup).filter(
+            Rollup.user_id == user_id,
+            Rollup.year == date.year,
+            Rollup.month == date.month,
+            Rollup.category_id == category_id,
+            Rollup.count <= 0,
+        ).delete(synchronize_session=False)
+
+
+def add(db: Session, expense: models.Expense):
+    apply(db, expense.user_id, expense.date, expense.category_id, expense.amount, 1)
+
+
+def remove(db: Session, expense: models.Expense):
+    apply(db, expense.user_id, expense.date, expense.category_id, -expense.amount, -1)
+
+
+def move(db: Session, old: dict, expense: models.Expense):
+    """Re-bucket an edited expense. `old` holds its previous date, category_id and amount."""
+    same_bucket = (
+        old["category_id"] == expense.category_id
+        and (old["date"].year, old["date"].month) == (expense.date.year, expense.date.month)
+    )
+    if same_bucket:
+        if old["amount"] != expense.amount:
+            apply(db, expense.user_id, expense.date, expense.category_id, expense.amount - old["amount"], 0)
+        return
+    apply(db, expense.user_id, old["date"], old["category_id"], -old["amount"], -1)
+    add(db, expense)
+
+
+class Deltas:
+    """Accumulates bucket changes so a bulk write costs one upsert per touched bucket."""
+
+    def __init__(self):
+        self._buckets = defaultdict(lambda: [0.0, 0])
+
+    def add(self, date: datetime, category_id: int, amount: float, count: int = 1):
+        bucket = self._buckets[(date.year, date.month, category_id)]
+        bucket[0] += amount
+        bucket[1] += count
+
+    def remove(self, date: datetime, category_id: int, amount: float):
+        self.add(date, category_id, -amount, -1)
+
+    def flush(self, db: Session, user_id: int):
+        for (year, month, category_id), (amount, count) in self._buckets.items():
+            if amount or count:
+                apply(db, user_id, datetime(year, month, 1), category_id, amount, count)
+        self._buckets.clear()
+
+
+def month_totals(db: Session, user_id: int, year: int, month: int):
+    """(category_id, total, count) rows for one month."""
+    return db.query(Rollup.category_id, Rollup.total, Rollup.count).filter(
+        Rollup.user_id == user_id,
+        Rollup.year == year,
+        Rollup.month == month,
+    )
+
+
+def range_totals(db: Session, user_id: int, first: tuple, last: tuple):
+    """(year, month, category_id, total, count) rows for the inclusive (year, month) range."""
+    return db.query(Rollup.year, Rollup.month, Rollup.category_id, Rollup.total, Rollup.count).filter(
+        Rollup.user_id == user_id,
+        tuple_(Rollup.year, Rollup.month) >= first,
+        tuple_(Rollup.year, Rollup.month) <= last,
+    )
+
+
+def _since(q, since):
+    """Restrict a rollup query to buckets from `since`'s month on."""
+    if since is None:
+        return q
+    return q.filter(tuple_(Rollup.year, Rollup.month) >= (since.year, since.month))
+
+
+def _recomputed(db: Session, user_id: Optional[int] = None, since=None):
+    """The rollup as it should be, aggregated straight from expenses dated `since` or later."""
+    year_col = extract("year", models.Expense.date)
+    month_col = extract("month", models.Expense.date)
+    q = db.query(
+        models.Expense.user_id,
+        year_col,
+        month_col,
+        models.Expense.category_id,
+        func.sum(models.Expense.amount),
+        func.count(models.Expense.id),
+    )
+    if user_id is not None:
+        q = q.filter(models.Expense.user_id == user_id)
+    if since is not None:
+        q = q.filter(models.Expense.date >= datetime.combine(since, datetime.min.time()))
+    q = q.group_by(models.Expense.user_id, year_col, month_col, models.Expense.category_id)
+    return {(uid, int(y), int(m), cat): (total, count) for uid, y, m, cat, total, count in q}
+
+
+def verify(db: Session, user_id: Optional[int] = None):
+    """Compare the rollup with expenses; return one dict per drifted bucket."""
+    since = partitions.horizon(db)
+    expected = _recomputed(db, user_id, since)
+    q = _since(db.query(Rollup), since)
+    if user_id is not None:
+        q = q.filter(Rollup.user_id == user_id)
+    actual = {(r.user_id, r.year, r.month, r.category_id): (r.total, r.count) for r in q}
+
+    drift = []
+    for key in sorted(expected.keys() | actual.keys(), key=str):
+        want_total, want_count = expected.get(key, (0.0, 0))
+        got_total, got_count = actual.get(key, (0.0, 0))
+        if want_count != got_count or abs(want_total - got_total) > DRIFT_TOLERANCE:
+            uid, year, month, category_id = key
+            drift.append({
+                "user_id": uid, "year": year, "month": month, "category_id": category_id,
+                "expected_total": want_total, "actual_total": got_total,
+                "expected_count": want_count, "actual_count": got_count,
+            })
+    return drift
+
+
+def rebuild(db: Session, user_id: Optional[int] = None) -> int:
+    """Replace the rollup with a fresh aggregate of expenses. Returns the bucket count.
+
+    Does not commit; the caller decides the transaction boundary.
+    """
+    since = partitions.horizon(db)
+    q = _since(db.query(Rollup), since)
+    if user_id is not None:
+        q = q.filter(Rollup.user_id == user_id)
+    q.delete(synchronize_session=False)
+    rows = [
+        {"user_id": uid, "year": y, "month": m, "category_id": cat, "total": total, "count": count}
+        for (uid, y, m, cat), (total, count) in _recomputed(db, user_id, since).items()
+    ]
+    if rows:
+        db.execute(Rollup.__table__.insert(), rows)
+    return len(rows)
+
+
+def main(argv=None) -> int:
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        drift = verify(db, args.user_id)
+        for d in drift:
+            print(
+                "drift user={user_id} {year}-{month:02d} category={category_id}: "
+                "total {actual_total} != {expected_total}, "
+                "count {actual_count} != {expected_count}".format(**d)
+            )
+        print(f"{len(drift)} drifted bucket(s)")
+        if args.command == "rebuild":
+            buckets = rebuild(db, args.user_id)
+            db.commit()
+            print(f"rebuilt {buckets} bucket(s)")
+            return 0
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
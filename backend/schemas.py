@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, StringConstraints, TypeAdapter, computed_field
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, List, Literal, Optional, Union
+from typing_extensions import TypedDict
 
 
 # ── User ──────────────────────────────────────────────────────────────────────
@@ -34,14 +35,29 @@ class Token(BaseModel):
 
 # ── Expense ───────────────────────────────────────────────────────────────────
 
+# Names become rows in ``categories`` (unknown ones are created as custom categories).
+CategoryName = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=64)]
+
+
 class ExpenseCreate(BaseModel):
     amount: float
-    category: str
+    category: CategoryName
     note: Optional[str] = ""
     date: datetime
 
 
+class ExpenseUpdate(BaseModel):
+    """Partial update: only the fields that are sent are changed."""
+
+    amount: Optional[float] = None
+    category: Optional[CategoryName] = None
+    note: Optional[str] = None
+    date: Optional[datetime] = None
+
+
 class ExpenseOut(ExpenseCreate):
+    # Output is not re-validated against input rules; older names may not meet them.
+    category: str
     id: int
     user_id: int
     created_at: datetime
@@ -50,6 +66,68 @@ class ExpenseOut(ExpenseCreate):
         from_attributes = True
 
 
+class ExpenseRecord(TypedDict):
+    """ExpenseOut's JSON shape (same field order) for rows that come straight from the DB."""
+
+    amount: float
+    category: str
+    note: Optional[str]
+    date: datetime
+    id: int
+    user_id: int
+    created_at: Optional[datetime]
+
+
+_expense_records = TypeAdapter(List[ExpenseRecord])
+
+
+def dump_expenses(records: list) -> bytes:
+    """Serialize expense records to a JSON array in one pass, without validating them.
+
+    `records` are dicts from ``crud.expense_records``. Building and validating an ExpenseOut
+    per row and then encoding it costs more than the query on large pages.
+    """
+    return _expense_records.dump_json(records)
+
+
+class CreateOperation(BaseModel):
+    op: Literal["create"]
+    data: ExpenseCreate
+
+
+class UpdateOperation(BaseModel):
+    op: Literal["update"]
+    id: int
+    data: ExpenseUpdate
+
+
+class DeleteOperation(BaseModel):
+    op: Literal["delete"]
+    id: int
+
+
+ExpenseOperation = Annotated[
+    Union[CreateOperation, UpdateOperation, DeleteOperation], Field(discriminator="op")
+]
+
+
+class ExpenseBatch(BaseModel):
+    operations: List[ExpenseOperation] = Field(..., min_length=1, max_length=500)
+
+
+class ExpenseOperationResult(BaseModel):
+    index: int
+    op: str
+    status: int
+    id: Optional[int] = None
+    expense: Optional[ExpenseOut] = None
+    error: Optional[str] = None
+
+
+class ExpenseBatchResult(BaseModel):
+    results: List[ExpenseOperationResult]
+
+
 # ── Budget ────────────────────────────────────────────────────────────────────
 
 class BudgetUpdate(BaseModel):
@@ -62,3 +140,59 @@ class BudgetOut(BudgetUpdate):
 
     class Config:
         from_attributes = True
+
+
+# ── Categories ────────────────────────────────────────────────────────────────
+
+class CategoryCreate(BaseModel):
+    name: CategoryName
+
+
+class CategoryOut(BaseModel):
+    id: int
+    name: str
+    custom: bool
+
+
+# ── Dashboard ─────────────────────────────────────────────────────────────────
+
+class DashboardOut(BaseModel):
+    user: UserOut
+    budget: BudgetOut
+    # Same shape as a GET /stream/budget event: /analytics/summary plus remaining,
+    # percent_used and over_limit.
+    summary: dict
+    recent_expenses: List[ExpenseOut]
+
+
+# ── Jobs ──────────────────────────────────────────────────────────────────────
+
+class JobCreate(BaseModel):
+    # Imports and account deletion have their own endpoints.
+    kind: Literal["rollup_rebuild"]
+
+
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    done: int
+    total: Optional[int] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @computed_field
+    @property
+    def progress(self) -> Optional[float]:
+        """Fraction complete, when the job knows its total."""
+        if self.status == "succeeded":
+            return 1.0
+        if not self.total:
+            return None
+        return round(min(self.done / self.total, 1.0), 4)
+
+    class Config:
+        from_attributes = True
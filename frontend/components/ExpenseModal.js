@@ -1,13 +1,8 @@
 import { useState, useEffect } from "react";
-import { createExpense, updateExpense } from "../lib/api";
+import { createExpense, updateExpense, getCategories } from "../lib/api";
 import toast from "react-hot-toast";
 import { format } from "date-fns";
 
-const CATEGORIES = [
-  "Food & Drink", "Transport", "Housing", "Entertainment",
-  "Health", "Shopping", "Utilities", "Other"
-];
-
 export default function ExpenseModal({ expense, onClose, onSaved }) {
   const [form, setForm] = useState({
     amount: "",
@@ -16,6 +11,11 @@ export default function ExpenseModal({ expense, onClose, onSaved }) {
     date: format(new Date(), "yyyy-MM-dd'T'HH:mm"),
   });
   const [loading, setLoading] = useState(false);
+  const [categories, setCategories] = useState([]);
+
+  useEffect(() => {
+    getCategories().then(({ data }) => setCategories(data.map((c) => c.name)));
+  }, []);
 
   useEffect(() => {
     if (expense) {
@@ -96,7 +96,9 @@ export default function ExpenseModal({ expense, onClose, onSaved }) {
               value={form.category}
               onChange={(e) => setForm({ ...form, category: e.target.value })}
             >
-              {CATEGORIES.map((c) => <option key={c}>{c}</option>)}
+              {/* Keep the current value selectable while the list loads. */}
+              {(categories.includes(form.category) ? categories : [form.category, ...categories])
+                .map((c) => <option key={c}>{c}</option>)}
             </select>
           </div>
 
@@ -7,11 +7,18 @@ const api = axios.create({ baseURL: API_URL });
 api.interceptors.request.use((config) => {
   const token = typeof window !== "undefined" ? localStorage.getItem("token") : null;
   if (token) config.headers.Authorization = `Bearer ${token}`;
+  // Sent back after a write so any server worker reads this user's data from the primary.
+  const readPrimary = typeof window !== "undefined" ? localStorage.getItem("readPrimary") : null;
+  if (readPrimary) config.headers["X-Read-Primary"] = readPrimary;
   return config;
 });
 
 api.interceptors.response.use(
-  (res) => res,
+  (res) => {
+    const readPrimary = res.headers["x-read-primary"];
+    if (readPrimary) localStorage.setItem("readPrimary", readPrimary);
+    return res;
+  },
   (err) => {
     if (err.response?.status === 401 && typeof window !== "undefined") {
       localStorage.removeItem("token");
@@ -28,12 +35,23 @@ export default api;
 export const register = (data) => api.post("/auth/register", data);
 export const login = (data) => api.post("/auth/login", data);
 export const getMe = () => api.get("/auth/me");
+export const deleteAccount = () => api.delete("/auth/me");
 
 // ── Expenses ──────────────────────────────────────────────────────────────────
 export const getExpenses = (params) => api.get("/expenses", { params });
 export const createExpense = (data) => api.post("/expenses", data);
 export const updateExpense = (id, data) => api.put(`/expenses/${id}`, data);
 export const deleteExpense = (id) => api.delete(`/expenses/${id}`);
+export const importExpenses = (file, { background = false } = {}) => {
+  const form = new FormData();
+  form.append("file", file);
+  return api.post("/expenses/import", form, { params: background ? { background: true } : {} });
+};
+export const batchExpenses = (operations) => api.post("/expenses/batch", { operations });
+
+// ── Categories ────────────────────────────────────────────────────────────────
+export const getCategories = () => api.get("/categories");
+export const createCategory = (name) => api.post("/categories", { name });
 
 // ── Budget ────────────────────────────────────────────────────────────────────
 export const getBudget = () => api.get("/budget");
@@ -41,3 +59,49 @@ export const updateBudget = (data) => api.put("/budget", data);
 
 // ── Analytics ─────────────────────────────────────────────────────────────────
 export const getSummary = (params) => api.get("/analytics/summary", { params });
+export const getTrend = (params) => api.get("/analytics/trend", { params });
+export const getForecast = (params) => api.get("/analytics/forecast", { params });
+
+// ── Dashboard ─────────────────────────────────────────────────────────────────
+export const getDashboard = (params) => api.get("/dashboard", { params });
+
+// ── Jobs ──────────────────────────────────────────────────────────────────────
+export const createJob = (kind) => api.post("/jobs", { kind });
+export const getJob = (id) => api.get(`/jobs/${id}`);
+
+// ── Live updates ──────────────────────────────────────────────────────────────
+// EventSource cannot send an Authorization header, so the stream is read with fetch.
+// Calls onStatus with each budget status until `signal` aborts; reconnects after drops.
+export async function streamBudget(onStatus, { signal } = {}) {
+  while (!signal?.aborted) {
+    try {
+      const res = await fetch(`${API_URL}/stream/budget`, {
+        headers: { Authorization: `Bearer ${localStorage.getItem("token")}` },
+        signal,
+      });
+      if (res.status === 401) {
+        localStorage.removeItem("token");
+        localStorage.removeItem("user");
+        window.location.href = "/login";
+        return;
+      }
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const event of events) {
+          const data = event.split("\n").filter((l) => l.startsWith("data: ")).map((l) => l.slice(6));
+          if (data.length) onStatus(JSON.parse(data.join("\n")));
+        }
+      }
+    } catch (err) {
+      if (signal?.aborted) return;
+    }
+    await new Promise((resolve) => setTimeout(resolve, 5000));
+  }
+}
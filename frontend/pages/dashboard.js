@@ -1,7 +1,7 @@
 import { useEffect, useState } from "react";
 import { useAuth } from "../hooks/useAuth";
 import Layout from "../components/Layout";
-import { getSummary, getExpenses } from "../lib/api";
+import { getDashboard, getExpenses, streamBudget } from "../lib/api";
 import { useRouter } from "next/router";
 import { format } from "date-fns";
 import {
@@ -47,13 +47,24 @@ export default function Dashboard() {
 
   useEffect(() => {
     if (!user) return;
-    Promise.all([
-      getSummary({ month: now.getMonth() + 1, year: now.getFullYear() }),
-      getExpenses({ month: now.getMonth() + 1, year: now.getFullYear() }),
-    ]).then(([s, e]) => {
-      setSummary(s.data);
-      setRecentExpenses(e.data.slice(0, 5));
+    const month = now.getMonth() + 1, year = now.getFullYear();
+    getDashboard({ month, year, recent: 5 }).then(({ data }) => {
+      setSummary(data.summary);
+      setRecentExpenses(data.recent_expenses);
     });
+    // The server then pushes the month's status on connect and after every change; the
+    // first push repeats what /dashboard returned.
+    const controller = new AbortController();
+    let first = true;
+    streamBudget((status) => {
+      setSummary(status);
+      if (first) {
+        first = false;
+        return;
+      }
+      getExpenses({ month, year, limit: 5 }).then((e) => setRecentExpenses(e.data));
+    }, { signal: controller.signal });
+    return () => controller.abort();
   }, [user]);
 
   if (loading || !user) return null;
@@ -2,16 +2,11 @@ import { useEffect, useState, useCallback } from "react";
 import { useAuth } from "../hooks/useAuth";
 import Layout from "../components/Layout";
 import ExpenseModal from "../components/ExpenseModal";
-import { getExpenses, deleteExpense } from "../lib/api";
+import { getExpenses, deleteExpense, getCategories } from "../lib/api";
 import { useRouter } from "next/router";
 import { format } from "date-fns";
 import toast from "react-hot-toast";
 
-const CATEGORIES = [
-  "All", "Food & Drink", "Transport", "Housing", "Entertainment",
-  "Health", "Shopping", "Utilities", "Other"
-];
-
 const CATEGORY_ICONS = {
   "Food & Drink": "🍔", "Transport": "🚗", "Housing": "🏠",
   "Entertainment": "🎬", "Health": "💊", "Shopping": "🛍",
@@ -27,6 +22,8 @@ export default function ExpensesPage() {
   const [showModal, setShowModal] = useState(false);
   const [editExpense, setEditExpense] = useState(null);
   const [fetching, setFetching] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [categories, setCategories] = useState([]);
 
   useEffect(() => {
     if (!loading && !user) router.replace("/login");
@@ -38,11 +35,29 @@ export default function ExpensesPage() {
     const params = {};
     if (category !== "All") params.category = category;
     if (search) params.search = search;
-    const { data } = await getExpenses(params);
+    const { data, headers } = await getExpenses(params);
     setExpenses(data);
+    setNextCursor(headers["x-next-cursor"] || null);
     setFetching(false);
   }, [user, category, search]);
 
+  const loadMore = async () => {
+    const params = { cursor: nextCursor };
+    if (category !== "All") params.category = category;
+    if (search) params.search = search;
+    const { data, headers } = await getExpenses(params);
+    setExpenses((prev) => [...prev, ...data]);
+    setNextCursor(headers["x-next-cursor"] || null);
+  };
+
+  const fetchCategories = useCallback(async () => {
+    if (!user) return;
+    const { data } = await getCategories();
+    setCategories(data.map((c) => c.name));
+  }, [user]);
+
+  useEffect(() => { fetchCategories(); }, [fetchCategories]);
+
   useEffect(() => {
     const t = setTimeout(fetchExpenses, 300);
     return () => clearTimeout(t);
@@ -64,6 +79,7 @@ export default function ExpensesPage() {
     setShowModal(false);
     setEditExpense(null);
     fetchExpenses();
+    fetchCategories();
   };
 
   if (loading || !user) return null;
@@ -97,7 +113,7 @@ export default function ExpensesPage() {
             style={{ flex: 1, minWidth: 200 }}
           />
           <select className="input" value={category} onChange={(e) => setCategory(e.target.value)} style={{ width: 180 }}>
-            {CATEGORIES.map((c) => <option key={c}>{c}</option>)}
+            {["All", ...categories].map((c) => <option key={c}>{c}</option>)}
           </select>
         </div>
 
@@ -174,6 +190,12 @@ export default function ExpensesPage() {
             ))
           )}
         </div>
+
+        {nextCursor && !fetching && (
+          <div style={{ textAlign: "center", marginTop: "1rem" }}>
+            <button className="btn btn-ghost" onClick={loadMore}>Load more</button>
+          </div>
+        )}
       </div>
 
       {showModal && (